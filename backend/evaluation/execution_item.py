@@ -5,10 +5,10 @@ from dataclasses import dataclass
 from typing import List
 
 import numpy as np
-from faker import Factory
+from faker import Factory, Faker
 
-from backend.integrations.database import get_testfails_for_revision
-from backend.selection.problem_data import ProblemData
+from backend.integrations.history import DatabaseHistory, HistoryProvider
+from backend.selection.problem_data import ProblemData, TestNameIndex
 
 
 def print_function_values_to_screen(solutions, data):
@@ -16,12 +16,23 @@ def print_function_values_to_screen(solutions, data):
     if type(solutions) is not list:
         solutions = [solutions]
 
-    for solution in solutions:
-        print(str(solutions.index(solution)) + ": ", sep="  ", end="", flush=True)
+    for i, solution in enumerate(solutions):
+        print(str(i) + ": ", sep="  ", end="", flush=True)
         print(solution.objectives, sep="  ", end="", flush=True)
-        pos = np.array(solution.variables[0])
-        rev_solution = list(data.tests_index[pos == 1])
-        print(f" (sol_size: {len(rev_solution)})")
+        sol_size = np.count_nonzero(solution.variables[0])
+        print(f" (sol_size: {sol_size})")
+
+
+def get_solution_tests(solution, data: ProblemData) -> List[str]:
+    """
+    Get the names of the tests selected by a solution.
+
+    :param solution: solution found by the optimizer
+    :param data: data associated with the execution
+    :return: list of test names
+    """
+    pos = np.array(solution.variables[0])
+    return list(data.tests_index[pos == 1])
 
 
 @dataclass
@@ -36,12 +47,20 @@ class RevisionResults:
     solution_metrics: list
     new_feedback_time: float
     computing_time: float
+    cache_hit: bool
+    timings: dict
     orig_rev_history: set
     real_rev_history: set
     innocent: bool
 
     def __init__(
-        self, svn_log_entry, branch, ignored_tests, previous_rev, masked=False
+        self,
+        svn_log_entry,
+        branch,
+        ignored_tests,
+        previous_rev,
+        masked=False,
+        history=None,
     ):
         self.branch = branch
         self.rev_id = svn_log_entry.revision
@@ -52,7 +71,9 @@ class RevisionResults:
         self.error_no_changed_items = None
         self.innocent = None
 
-        self.set_revision_history(previous_rev, ignored_tests)
+        if history is None:
+            history = DatabaseHistory()
+        self.set_revision_history(previous_rev, ignored_tests, history)
 
         if masked:
             self.fake = Factory.create()
@@ -61,17 +82,67 @@ class RevisionResults:
         self.score = (-1, -1, -1, -1)
         self.new_feedback_time = 0
         self.computing_time = 0
+        self.cache_hit = False
+        self.timings = {}
         self.solution_metrics = []
 
-    def set_revision_history(self, previous: "RevisionResults", ignored: List[str]):
+    def to_dict(self) -> dict:
+        """
+        Get a JSON serializable representation of these results (without the solutions found).
+
+        :return: dictionary with the results values
+        """
+        return {
+            "branch": self.branch,
+            "rev_id": self.rev_id,
+            "rev_date": self.rev_date,
+            "changelist": [list(change) for change in self.changelist],
+            "masked": self.masked,
+            "error_no_changed_items": self.error_no_changed_items,
+            "innocent": self.innocent,
+            "orig_rev_history": sorted(self.orig_rev_history),
+            "real_rev_history": sorted(self.real_rev_history),
+            "score": list(self.score),
+            "solution_metrics": list(self.solution_metrics),
+            "new_feedback_time": self.new_feedback_time,
+            "computing_time": self.computing_time,
+            "cache_hit": self.cache_hit,
+            "timings": self.timings,
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict, fake: Faker = None) -> "RevisionResults":
+        """
+        Rebuild results from their dictionary representation (see to_dict).
+
+        :param values: dictionary with the results values
+        :param fake: Faker instance to mask the results (a new one is created if masked and not given)
+        :return: results object
+        """
+        results = cls.__new__(cls)
+        results.__dict__.update(values)
+        results.changelist = [tuple(change) for change in values["changelist"]]
+        results.orig_rev_history = set(values["orig_rev_history"])
+        results.real_rev_history = set(values["real_rev_history"])
+        results.score = tuple(values["score"])
+        results.cache_hit = values.get("cache_hit", False)
+        results.solutions_found = []
+        if results.masked:
+            results.fake = fake if fake is not None else Factory.create()
+        return results
+
+    def set_revision_history(
+        self, previous: "RevisionResults", ignored: List[str], history: HistoryProvider
+    ):
         """
         Set revision history values (i.e. lists of failing tests names) for this revision.
 
         :param previous: execution results from the previous revision
         :param ignored: list of tests to ignore
+        :param history: provider of the build history data
         """
         # Set original revision history
-        rev_results = get_testfails_for_revision(revision=self.rev_id)
+        rev_results = history.get_testfails_for_revision(self.rev_id)
         self.orig_rev_history = set(rev_results.FULLNAME.values)
 
         # If no failing tests returned from the database, use failing tests of previous revision
@@ -97,6 +168,64 @@ class RevisionResults:
                 )
             )
 
+    def evaluate(self, data: ProblemData, fixed_demo=False):
+        """
+        Compute the score, solution metrics and feedback time of this execution, as print_results does,
+        but without printing anything.
+
+        :param data: data associated with this execution
+        :param fixed_demo: flag indicating whether this a random selection or not
+        """
+        if type(self.error_no_changed_items) == str:
+            return
+
+        if fixed_demo:
+            self.score, _ = self.get_solution_score(self.solutions_found)
+            self.computing_time = 0.1
+            rev_solution = self.solutions_found
+        else:
+            # The score of an execution is the score of the last solution in the front
+            self.score, _ = self.get_solution_score(
+                get_solution_tests(self.solutions_found[-1], data),
+                data.tests_name_index,
+            )
+            solution = self.solutions_found[0]
+            self.solution_metrics = solution.objectives
+            rev_solution = get_solution_tests(solution, data)
+
+        self.new_feedback_time = sum(
+            [data.history_test_execution_times[test] for test in rev_solution]
+        )
+
+    def get_record(self, data: ProblemData, with_tests=False) -> dict:
+        """
+        Get a compact record of this execution (after print_results or evaluate).
+
+        :param data: data associated with this execution
+        :param with_tests: include the tests selected by the first solution
+        :return: dictionary with the execution results
+        """
+        record = {
+            "rev_id": self.rev_id,
+            "rev_date": self.rev_date,
+            "changes": len(self.changelist),
+            "failed_tests": len(self.orig_rev_history),
+            "error": self.error_no_changed_items,
+            "score": list(self.score),
+            "solutions": len(self.solutions_found),
+            "solution_metrics": list(self.solution_metrics),
+            "computing_time": self.computing_time,
+            "cache_hit": self.cache_hit,
+            "new_feedback_time": self.new_feedback_time,
+        }
+        if with_tests and self.solutions_found:
+            if isinstance(self.solutions_found[0], str):
+                # For random selections, the solution is stored in self.solutions_found
+                record["tests"] = list(self.solutions_found)
+            else:
+                record["tests"] = get_solution_tests(self.solutions_found[0], data)
+        return record
+
     def print_results(self, data: ProblemData, fixed_demo=False):
         """
         Print execution results to stdout.
@@ -195,16 +324,17 @@ class RevisionResults:
         :param data: data related to this execution
         """
         # Computing Time
-        print("Computing time: " + str(self.computing_time))
+        cache_hit = " (result cache hit)" if self.cache_hit else ""
+        print("Computing time: " + str(self.computing_time) + cache_hit)
 
         # Objectives values of each solution
         print_function_values_to_screen(self.solutions_found, data)
 
         # Score of each solution
         for i, solution in enumerate(self.solutions_found):
-            pos = np.array(solution.variables[0])
-            rev_solution = list(data.tests_index[pos == 1])
-            self.print_solution_score(i, rev_solution)
+            self.print_solution_score(
+                i, get_solution_tests(solution, data), data.tests_name_index
+            )
 
     def print_execution_inspection(self, data: ProblemData):
         """
@@ -215,17 +345,17 @@ class RevisionResults:
         :param data: data related to this execution
         """
 
-        def inspection_checker(tests_data: np.ndarray):
+        def inspection_checker(is_available):
             """
-            Check if the provided array of tests contains the failing tests for this revision.
+            Check if the failing tests for this revision can be found in the available data.
 
             The counts of possible/impossible to find tests are printed.
 
-            :param tests_data: array of test names
+            :param is_available: function checking if a failing test can be found in the data
             """
             available, impossible = 0, 0
             for test in self.real_rev_history:
-                if any(x in test for x in tests_data):
+                if is_available(test):
                     # print(f"{test} = Available")
                     available += 1
                 else:
@@ -233,11 +363,13 @@ class RevisionResults:
                     impossible += 1
             print(f"Available={available} || Impossible={impossible}")
 
+        index = data.tests_name_index
         print(f"Check test availability vs original data - {data.original_tests.shape}")
-        inspection_checker(data.original_tests)
+        inspection_checker(index.contains_any)
 
+        filtered_tests = set(data.tests_index)
         print(f"Check test availability vs filtered data - {data.tests_index.shape}")
-        inspection_checker(data.tests_index)
+        inspection_checker(lambda t: not index.find_all(t).isdisjoint(filtered_tests))
 
     def print_solution_list(self, data: ProblemData):
         """
@@ -262,8 +394,7 @@ class RevisionResults:
         solution = self.solutions_found[0]
         self.solution_metrics = solution.objectives
 
-        pos = np.array(solution.variables[0])
-        rev_solution = list(data.tests_index[pos == 1])
+        rev_solution = get_solution_tests(solution, data)
         # Solution Size + Feedback Time
         print(f"Solution Size: {len(rev_solution)} tests")
         self.new_feedback_time = sum(
@@ -277,40 +408,59 @@ class RevisionResults:
         solution_tests = "\n\t".join(rev_solution)
         print(f"\t{solution_tests}")
 
-    def print_solution_score(self, i: int, rev_solution: List[str]):
+    def get_solution_score(self, rev_solution: List[str], index: TestNameIndex = None):
         """
-        Print score (i.e. number of failing tests found) of this solution.
+        Get score (i.e. number of failing tests found) of a solution.
 
-        :param i: number id of this solution
-        :param rev_solution: list of tests selected by this solution
+        :param rev_solution: list of tests selected by the solution
+        :param index: index of the tests the solution was selected from (e.g. the original tests of the data)
+        :return: score tuple (score %, # matched, # expected, # tests) and list of matching failing tests
         """
 
         def get_matching_tests() -> List[str]:
             """
-            Get list of selected tests matching with the set of failing tests.
+            Get list of failing tests containing the name of any selected test.
 
             :return: a list of test names
             """
+            selected = set(rev_solution)
+            names_index = index
+            if names_index is None or not names_index.names.issuperset(selected):
+                names_index = TestNameIndex(selected)
             return [
                 test
                 for test in self.real_rev_history
-                if any(x in test for x in rev_solution)
+                if not names_index.find_all(test).isdisjoint(selected)
             ]
 
         sol_size = len(rev_solution)
-        sol_id = f"Solution {i} ({sol_size})"
+        if len(self.real_rev_history) == 0:
+            return (-1, 0, 0, sol_size), []
+
+        matching = get_matching_tests()
+        score = (len(matching) / len(self.real_rev_history)) * 100
+        return (score, len(matching), len(self.real_rev_history), sol_size), matching
+
+    def print_solution_score(
+        self, i: int, rev_solution: List[str], index: TestNameIndex = None
+    ):
+        """
+        Print score (i.e. number of failing tests found) of this solution.
+
+        :param i: number id of this solution
+        :param rev_solution: list of tests selected by this solution
+        :param index: index of the tests the solution was selected from
+        """
+        self.score, matching = self.get_solution_score(rev_solution, index)
+        sol_id = f"Solution {i} ({len(rev_solution)})"
 
         if len(self.real_rev_history) == 0:
             print(f"{sol_id} = only ignored tests")
-            self.score = (-1, 0, 0, sol_size)
         else:
-            matching = get_matching_tests()
-            score = (len(matching) / len(self.real_rev_history)) * 100
+            score = self.score[0]
             match_vs_rev = f"{len(matching)}/{len(self.real_rev_history)}"
             if self.masked:
                 print(f"{sol_id} = {match_vs_rev} ({score:.0f}%)")
             else:
                 # Also print matching test names, if not using masked mode
                 print(f"{sol_id} = {match_vs_rev} ({score:.0f}%) -> {matching}")
-
-            self.score = (score, len(matching), len(self.real_rev_history), sol_size)
@@ -0,0 +1,113 @@
+# coding=utf-8
+import json
+import os
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+from faker import Factory
+
+from backend.evaluation.execution_item import RevisionResults
+
+
+def to_json_value(value):
+    """
+    Convert numpy scalars to the equivalent Python values, for json.dumps.
+
+    :param value: value not serializable by the json module
+    :return: serializable value
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class ResultsLog:
+    """
+    JSON-lines log of the results of a batch run, with one line appended for each finished revision.
+
+    The log is flushed after each line, so a run can be resumed after a crash by skipping the logged
+    revisions. A truncated last line (from a crash while writing) is removed when the log is opened.
+    """
+
+    def __init__(self, path: str, restart: bool = False):
+        """
+        ResultsLog initialization.
+
+        :param path: path of the log file
+        :param restart: discard the results logged by previous runs
+        """
+        self.path = path
+        if restart and os.path.exists(path):
+            os.remove(path)
+        self.remove_truncated_line()
+
+    def remove_truncated_line(self):
+        """
+        Remove an incomplete last line (from a crash while writing), so new lines are not appended to it.
+
+        """
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, mode="rb+") as log_file:
+            content = log_file.read()
+            if content and not content.endswith(b"\n"):
+                log_file.truncate(content.rfind(b"\n") + 1)
+
+    def append(self, results: RevisionResults):
+        """
+        Append the results of a revision to the log.
+
+        :param results: results of the revision
+        """
+        line = json.dumps(results.to_dict(), default=to_json_value)
+        with open(self.path, mode="a") as log_file:
+            log_file.write(line + "\n")
+            log_file.flush()
+            os.fsync(log_file.fileno())
+
+    def read(self) -> Iterator[RevisionResults]:
+        """
+        Read the logged results, in the order they were appended.
+
+        :return: iterator over the results of each revision
+        """
+        if not os.path.exists(self.path):
+            return
+
+        # Masked results share the same Faker instance, instead of creating one for each line
+        fake = None
+        with open(self.path, mode="r") as log_file:
+            for line in log_file:
+                try:
+                    values = json.loads(line)
+                except ValueError:
+                    print(f"Ignoring invalid line in results log {self.path}")
+                    continue
+                if values["masked"] and fake is None:
+                    fake = Factory.create()
+                yield RevisionResults.from_dict(values, fake)
+
+    def get_revisions(self) -> Dict[str, bool]:
+        """
+        Get the ids of the revisions already logged, and whether they had failing tests (i.e. the pipeline
+        was run for them).
+
+        :return: map of revision ids (as strings) to whether the revision had failing tests
+        """
+        return {
+            str(results.rev_id): len(results.real_rev_history) > 0
+            for results in self.read()
+        }
+
+    def get(self, rev_id: str) -> Optional[RevisionResults]:
+        """
+        Read the logged results of a revision.
+
+        :param rev_id: revision id (as string)
+        :return: results of the revision, or None if it is not logged
+        """
+        for results in self.read():
+            if str(results.rev_id) == rev_id:
+                return results
+        return None
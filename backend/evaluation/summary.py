@@ -1,22 +1,33 @@
 # coding=utf-8
 import gc
+import json
 import pickle
-from collections import Counter
+from collections import Counter, defaultdict
 from dataclasses import dataclass
-from typing import List, BinaryIO
+from typing import Dict, Iterable, List, BinaryIO, TextIO
 
 import numpy as np
 
 from backend.evaluation import utils
 from backend.evaluation.execution_item import RevisionResults
+from backend.evaluation.results_log import ResultsLog
+from backend.evaluation.utils import ExecutionRecord, get_execution_record
 from backend.selection.problem_data import ProblemData
 
 STATS_KEYS = ["avg", "min", "max", "std", "P10", "P25", "P50", "P75", "P90"]
 
+# Error messages patterns of each error case of the executions
+ERROR_CASES = {
+    "No .cs Files": "no covered .cs files",
+    "No Coverage Data": "no coverage data",
+    "New Files": "new files or modified",
+}
+
 
 @dataclass
 class ResultsSummary:
     data: List[RevisionResults]
+    execution_records: List[ExecutionRecord]
     commits: dict
     executions: dict
     errors: dict
@@ -25,48 +36,72 @@ class ResultsSummary:
     computing_time: dict
     orig_feedback_time: float
     new_feedback_time: dict
+    timings: dict
 
-    def __init__(self, results: List[RevisionResults], data: ProblemData):
+    def __init__(self, results: Iterable[RevisionResults], data: ProblemData):
         """
         Populate results summary with evaluation metrics values.
 
-        :param results: list of execution results
+        The results are processed in a single pass, so they can be streamed (e.g. from a results log):
+        the metrics are computed from the values kept for each tool execution, and the results are only
+        stored (without the solutions found) for the pickle export.
+
+        :param results: iterable of execution results
         :param data: full dataset related to this set of results
         """
-        tool_executions = utils.get_tool_executions(results)
-        tool_no_exec = utils.get_tool_no_executions(results)
-        total_innocent_reds = utils.get_total_innocent_reds(results)
+        self.data = []
+        self.execution_records = []
+        self.errors = {error: {"total": 0, "red": 0} for error in ERROR_CASES}
+        total, red_commits, total_innocent_reds = 0, 0, 0
+        spans, counters = defaultdict(list), Counter()
+
+        previous_fails = set()
+        for res in results:
+            red = len(res.real_rev_history) > 0
+            total += 1
+            red_commits += red
+
+            if type(res.error_no_changed_items) == str:
+                # Errors
+                for error, pattern in ERROR_CASES.items():
+                    if pattern in res.error_no_changed_items:
+                        self.errors[error]["total"] += 1
+                        self.errors[error]["red"] += red
+            else:
+                # If previous revision test fails is a superset, then the current commit is innocent
+                if red and previous_fails.issuperset(res.real_rev_history):
+                    total_innocent_reds += 1
+                    res.innocent = True
+                self.execution_records.append(get_execution_record(res))
+            previous_fails = res.real_rev_history
+
+            # Per-stage latency (only for runs with timings enabled)
+            timings = getattr(res, "timings", None)
+            if timings:
+                for name, seconds in timings["spans"].items():
+                    spans[name].append(seconds * 1000)
+                counters.update(timings["counters"])
+
+            res.solutions_found = []
+            self.data.append(res)
 
         # Commits
-        red_commits = [res for res in results if len(res.real_rev_history) > 0]
         self.commits = {
-            "total": len(results),
-            "red": len(red_commits),
-            "red_p": len(red_commits) / len(results),
+            "total": total,
+            "red": red_commits,
+            "red_p": red_commits / total,
         }
 
         # Executions
-        red_executions = [
-            res for res in tool_executions if len(res.real_rev_history) > 0
-        ]
+        tool_executions = self.execution_records
+        red_executions = [res for res in tool_executions if res.red]
         self.executions = {
             "total": len(tool_executions),
-            "total_p": len(tool_executions) / len(results),
+            "total_p": len(tool_executions) / total,
             "red": len(red_executions),
             "red_p": len(red_executions) / len(tool_executions),
         }
 
-        # Errors
-        error_cases = {
-            "No .cs Files": "no covered .cs files",
-            "No Coverage Data": "no coverage data",
-            "New Files": "new files or modified",
-        }
-        self.errors = {}
-        for error, pattern in error_cases.items():
-            total, red = utils.get_error_stats(pattern, tool_no_exec)
-            self.errors[error] = {"total": len(total), "red": len(red)}
-
         # Red Stats: "yes, at least one", Precision, Recall
         self.set_red_stats(red_executions, total_innocent_reds)
 
@@ -78,16 +113,24 @@ class ResultsSummary:
         self.orig_feedback_time = sum(data.history_test_execution_times.values())
         self.set_feedback_time(tool_executions)
 
-        # Store data
-        self.data = results
-        for res in self.data:
-            res.solutions_found = []
+        self.set_timings(spans, counters)
 
-    def set_red_stats(self, red_execs: List[RevisionResults], total_innocent_reds: int):
+    @classmethod
+    def from_log(cls, log: ResultsLog, data: ProblemData) -> "ResultsSummary":
+        """
+        Build a results summary by streaming the results of a batch run log.
+
+        :param log: results log of the batch run
+        :param data: full dataset related to this set of results
+        :return: results summary
+        """
+        return cls(log.read(), data)
+
+    def set_red_stats(self, red_execs: List[ExecutionRecord], total_innocent_reds: int):
         """
         Populate map of values related to red executions, namely Precision and Recall values.
 
-        :param red_execs: list of execution results for red commits
+        :param red_execs: list of execution records for red commits
         :param total_innocent_reds: total number of innocent red commits
         """
         not_found_red_tests = [res for res in red_execs if res.score[0] == 0]
@@ -105,37 +148,42 @@ class ResultsSummary:
             "Micro-Recall": utils.get_micro_recall(red_execs),
         }
 
-    def set_solution_size(self, executions: List[RevisionResults]):
+    def set_solution_size(self, executions: List[ExecutionRecord]):
         """
         Populate solution size map with stats and percentiles values
 
         - Stats: average, min, max, standard deviation
         - Percentiles: 10, 25, 50, 75, 90
-        :param executions: list of execution results
+        :param executions: list of execution records
         """
         sizes = np.array([res.score[3] for res in executions])
         self.solution_size = dict(zip(STATS_KEYS, utils.get_metric_stats(sizes)))
 
-    def set_computing_time(self, executions: List[RevisionResults]):
+    def set_computing_time(self, executions: List[ExecutionRecord]):
         """
         Populate computing time map with stats and percentiles values
 
         - Stats: average, min, max, standard deviation
         - Percentiles: 10, 25, 50, 75, 90
-        :param executions: list of execution results
+        Executions with solutions from the result cache are excluded, since the optimizer didn't run.
+        :param executions: list of execution records
         """
         times = np.array(
-            [res.computing_time for res in executions if res.computing_time > 0]
+            [
+                res.computing_time
+                for res in executions
+                if res.computing_time > 0 and not res.cache_hit
+            ]
         )
         self.computing_time = dict(zip(STATS_KEYS, utils.get_metric_stats(times)))
 
-    def set_feedback_time(self, executions: List[RevisionResults]):
+    def set_feedback_time(self, executions: List[ExecutionRecord]):
         """
         Populate feedback time map with stats and percentiles values
 
         - Stats: average, min, max, standard deviation
         - Percentiles: 10, 25, 50, 75, 90
-        :param executions: list of execution results
+        :param executions: list of execution records
         """
         feedback_times = np.array(
             [res.new_feedback_time for res in executions if res.new_feedback_time > 0]
@@ -144,20 +192,40 @@ class ResultsSummary:
             zip(STATS_KEYS, utils.get_metric_stats(feedback_times))
         )
 
+    def set_timings(self, spans: Dict[str, List[float]], counters: Counter):
+        """
+        Populate timings map with the stats and percentiles values (in milliseconds) of each pipeline stage,
+        plus the total of each counter (e.g. number of evaluations of each objective).
+
+        :param spans: map of stage names to their elapsed times (in milliseconds) in each execution
+        :param counters: total of each counter over the executions
+        """
+        self.timings = {
+            "spans_ms": {
+                name: dict(zip(STATS_KEYS, utils.get_metric_stats(np.array(values))))
+                for name, values in spans.items()
+            },
+            "counters": dict(counters),
+        }
+
     def recompute_innocent(self):
         """
         Recompute all evaluation metrics in this summary using the innocent commit filter
 
         """
-        results = self.data
-        tool_executions = utils.get_tool_executions(results)
-        total_innocent_reds = utils.get_total_innocent_reds(results)
-        red_executions = [
-            res for res in tool_executions if len(res.real_rev_history) > 0
-        ]
+        if not hasattr(self, "execution_records"):
+            # Summaries pickled before the execution records were kept
+            self.execution_records = [
+                get_execution_record(res)
+                for res in self.data
+                if type(res.error_no_changed_items) != str
+            ]
+        tool_executions = self.execution_records
+        red_executions = [res for res in tool_executions if res.red]
         not_innocent_red_executions = [
-            res for res in red_executions if res.innocent is not True
+            res for res in red_executions if not res.innocent
         ]
+        total_innocent_reds = len(red_executions) - len(not_innocent_red_executions)
         self.set_red_stats(not_innocent_red_executions, total_innocent_reds)
 
         self.set_solution_size(tool_executions)
@@ -206,6 +274,30 @@ class ResultsSummary:
         feedback_time = list(self.new_feedback_time.values())
         self.print_metric_stats("New Feedback Time", feedback_time)
 
+        timings = getattr(self, "timings", {})
+        for name, stats in timings.get("spans_ms", {}).items():
+            self.print_metric_stats(f"Stage {name} (ms)", list(stats.values()))
+        for name, total in timings.get("counters", {}).items():
+            print(f"Counter {name}: {total}")
+
+    def export_to_dict(self) -> dict:
+        """
+        Export the summary metrics and stats (without the execution results) to a dictionary.
+
+        :return: dictionary with the summary values
+        """
+        return {
+            "commits": self.commits,
+            "executions": self.executions,
+            "errors": self.errors,
+            "red_stats": self.red_stats,
+            "solution_size": self.solution_size,
+            "computing_time": self.computing_time,
+            "orig_feedback_time": self.orig_feedback_time,
+            "new_feedback_time": self.new_feedback_time,
+            "timings": getattr(self, "timings", {}),
+        }
+
     def export_to_pickle(self, file: BinaryIO):
         """
         Exports the summary to a pickle file.
@@ -216,6 +308,14 @@ class ResultsSummary:
         gc.collect()
         pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
 
+    def export_timings_to_json(self, file: TextIO):
+        """
+        Exports the per-stage timings and counters of the summary to a JSON file.
+
+        :param file: output file descriptor
+        """
+        json.dump(getattr(self, "timings", {}), file, indent=2)
+
     def export_to_csv_line(self, only_stats: bool = False, prefix: str = None) -> str:
         """
         Get a single CSV line representation of the summary using "|" (vertical bar) as separator.
@@ -1,10 +1,34 @@
 # coding=utf-8
-from typing import List, Tuple
+from collections import namedtuple
+from typing import List
 
 import numpy as np
 
 from backend.evaluation.execution_item import RevisionResults
 
+# Values of a tool execution needed for the evaluation metrics (kept instead of the whole results)
+ExecutionRecord = namedtuple(
+    "ExecutionRecord",
+    ["score", "red", "innocent", "computing_time", "cache_hit", "new_feedback_time"],
+)
+
+
+def get_execution_record(res: RevisionResults) -> ExecutionRecord:
+    """
+    Get the values of a tool execution needed for the evaluation metrics.
+
+    :param res: execution results
+    :return: execution record
+    """
+    return ExecutionRecord(
+        tuple(res.score),
+        len(res.real_rev_history) > 0,
+        res.innocent is True,
+        res.computing_time,
+        getattr(res, "cache_hit", False),
+        res.new_feedback_time,
+    )
+
 
 def get_metric_stats(data: np.ndarray) -> List[int]:
     """
@@ -21,11 +45,11 @@ def get_metric_stats(data: np.ndarray) -> List[int]:
     return list(map(int, [*stats, *percentiles]))
 
 
-def get_micro_recall(executions: List[RevisionResults]) -> float:
+def get_micro_recall(executions: List[ExecutionRecord]) -> float:
     """
     Calculate micro-averaged recall for a list of tool executions.
 
-    :param executions: list of RevisionResults objects
+    :param executions: list of execution records
     :return: micro-recall value
     """
     micro_recall_n = [res.score[1] for res in executions if res.score[2] > 0]
@@ -33,11 +57,11 @@ def get_micro_recall(executions: List[RevisionResults]) -> float:
     return sum(micro_recall_n) / sum(micro_recall_d)
 
 
-def get_macro_recall(executions: List[RevisionResults]) -> float:
+def get_macro_recall(executions: List[ExecutionRecord]) -> float:
     """
     Calculate macro-averaged recall for a list of tool executions.
 
-    :param executions: list of RevisionResults objects
+    :param executions: list of execution records
     :return: macro-recall value
     """
     red_tests_recall = [
@@ -46,11 +70,11 @@ def get_macro_recall(executions: List[RevisionResults]) -> float:
     return sum(red_tests_recall) / len(red_tests_recall)
 
 
-def get_micro_precision(executions: List[RevisionResults]) -> float:
+def get_micro_precision(executions: List[ExecutionRecord]) -> float:
     """
     Calculate micro-averaged precision for a list of tool executions.
 
-    :param executions: list of RevisionResults objects
+    :param executions: list of execution records
     :return: micro-precision value
     """
     micro_precision_n = [res.score[1] for res in executions if res.score[2] > 0]
@@ -58,11 +82,11 @@ def get_micro_precision(executions: List[RevisionResults]) -> float:
     return sum(micro_precision_n) / sum(micro_precision_d)
 
 
-def get_macro_precision(executions: List[RevisionResults]) -> float:
+def get_macro_precision(executions: List[ExecutionRecord]) -> float:
     """
     Calculate macro-averaged precision for a list of tool executions.
 
-    :param executions: list of RevisionResults objects
+    :param executions: list of execution records
     :return: macro-precision value
     """
     red_tests_precision = [
@@ -71,66 +95,3 @@ def get_macro_precision(executions: List[RevisionResults]) -> float:
         if res.score[2] > 0 and res.score[3] > 0
     ]
     return sum(red_tests_precision) / len(red_tests_precision)
-
-
-def get_error_stats(
-    pattern: str, executions: List[RevisionResults]
-) -> Tuple[List, List]:
-    """
-    Get lists of execution results with a given error message for all commits and for only red commits.
-
-    :param pattern: error message pattern to search for
-    :param executions: list of execution results
-    :return: two lists of execution results: one for all commits, another only for red commits
-    """
-    error_cases = [res for res in executions if pattern in res.error_no_changed_items]
-    red_error_cases = [res for res in error_cases if len(res.real_rev_history) > 0]
-    return error_cases, red_error_cases
-
-
-def get_tool_executions(executions: List[RevisionResults]) -> List[RevisionResults]:
-    """
-    Get only the tool executions from a list of execution results.
-
-    :param executions: list of execution results
-    :return: list of tool executions
-    """
-    return [res for res in executions if type(res.error_no_changed_items) != str]
-
-
-def get_tool_no_executions(executions: List[RevisionResults]) -> List[RevisionResults]:
-    """
-    Get only the failed tool executions from a list of execution results.
-
-    :param executions: list of execution results
-    :return: list of failed tool executions
-    """
-    return [res for res in executions if type(res.error_no_changed_items) == str]
-
-
-def get_total_innocent_reds(executions: List[RevisionResults]) -> int:
-    """
-    Get number of innocent red commits from a given list of execution results.
-
-    :param executions: list of execution results
-    :return: number of innocent red commits
-    """
-    count = 0
-    previous_fails = set()
-    for res in executions:
-        copy_res = res.real_rev_history.copy()
-        # If it is a tool execution over a red commit
-        if type(res.error_no_changed_items) != str and len(res.real_rev_history) > 0:
-            # If previous revision test fails is a superset, then the current commit is innocent
-            if previous_fails.issuperset(res.real_rev_history):
-                count += 1
-                res.innocent = True
-
-            # Filter tests present in previous revision test fails
-            # res.real_rev_history = set(filter(lambda x: x not in previous_fails, res.real_rev_history))
-            # # If the new set of test fails is empty, then the current commit is innocent
-            # if len(res.real_rev_history) == 0:
-            #     count += 1
-            #     res.innocent = True
-        previous_fails = copy_res
-    return count
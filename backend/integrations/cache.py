@@ -0,0 +1,260 @@
+# coding=utf-8
+import datetime
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from functools import update_wrapper, wraps
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from joblib import Memory
+
+# Default eviction limits for the integrations caches
+DEFAULT_BYTES_LIMIT = 2 * 1024 ** 3
+DEFAULT_AGE_LIMIT = datetime.timedelta(days=30)
+DEFAULT_EVICTION_INTERVAL = datetime.timedelta(minutes=10)
+
+# Registry of the caches created in this process
+CACHES = {}
+
+
+@dataclass
+class CacheItem:
+    function: str
+    path: str
+    size: int
+    last_access: float
+
+
+class CachedFunction:
+    """
+    joblib memoized function that counts cache hits and misses.
+
+    joblib memoizes a thin wrapper of the function that counts its executions, i.e. the misses. Every
+    other call is a hit, so the arguments of a call are only hashed once (by joblib itself).
+    """
+
+    def __init__(self, func, memory: Memory, on_miss=None, **kwargs):
+        """
+        CachedFunction initialization.
+
+        :param func: function to be memoized
+        :param memory: joblib memory where the results are stored
+        :param on_miss: function called after each miss (i.e. after a new result is stored)
+        :param kwargs: joblib cache options
+        """
+        self.calls = 0
+        self.misses = 0
+
+        @wraps(func)
+        def counted(*args, **kwargs):
+            self.misses += 1
+            return func(*args, **kwargs)
+
+        # joblib checks the source code at the location of the memoized function to invalidate its
+        # results, so the wrapper points to the location of the function (and entries stay valid)
+        counted.__code__ = counted.__code__.replace(
+            co_filename=func.__code__.co_filename,
+            co_firstlineno=func.__code__.co_firstlineno,
+        )
+        self.memorized = memory.cache(counted, **kwargs)
+        self.on_miss = on_miss
+        update_wrapper(self, func)
+
+    @property
+    def hits(self) -> int:
+        return self.calls - self.misses
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        misses = self.misses
+        result = self.memorized(*args, **kwargs)
+        if self.misses > misses and self.on_miss is not None:
+            self.on_miss()
+        return result
+
+    def check_call_in_cache(self, *args, **kwargs) -> bool:
+        return self.memorized.check_call_in_cache(*args, **kwargs)
+
+
+class ManagedCache:
+    """
+    joblib cache with size and age based eviction, plus hit/miss/bytes counters for each cached function.
+
+    Eviction runs when the cache is created and then after new results are stored, at most once per
+    eviction interval, so long-lived processes (e.g. the selection server) keep the cache bounded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        location: Path,
+        verbose: int = 0,
+        bytes_limit: Optional[int] = DEFAULT_BYTES_LIMIT,
+        age_limit: Optional[datetime.timedelta] = DEFAULT_AGE_LIMIT,
+        eviction_interval: datetime.timedelta = DEFAULT_EVICTION_INTERVAL,
+    ):
+        """
+        ManagedCache initialization.
+
+        :param name: name of the cache, used in the stats report
+        :param location: directory where joblib stores the cache
+        :param verbose: joblib verbosity level
+        :param bytes_limit: maximum size of the cache in bytes (None for unbounded)
+        :param age_limit: maximum time since the last access of an entry (None for unbounded)
+        :param eviction_interval: minimum time between evictions triggered by new results
+        """
+        self.name = name
+        self.location = Path(location)
+        self.memory = Memory(self.location, verbose=verbose)
+        self.functions: Dict[str, CachedFunction] = {}
+        self.bytes_limit = bytes_limit
+        self.age_limit = age_limit
+        self.eviction_interval = eviction_interval.total_seconds()
+        self.last_eviction = 0.0
+        self.evict()
+        CACHES[name] = self
+
+    def cache(self, func=None, **kwargs):
+        """
+        Decorator to memoize a function in this cache (usable as @cache or @cache()).
+
+        :param func: function to be memoized
+        :return: memoized function with hit/miss counters
+        """
+        if func is None:
+            return lambda f: self.cache(f, **kwargs)
+
+        cached = CachedFunction(func, self.memory, self.evict_if_due, **kwargs)
+        self.functions[func.__name__] = cached
+        return cached
+
+    def evict(self) -> List[CacheItem]:
+        """
+        Evict the entries over the eviction limits of this cache.
+
+        :return: list of evicted entries
+        """
+        self.last_eviction = time.monotonic()
+        if self.bytes_limit is None and self.age_limit is None:
+            return []
+        return self.reduce_size(self.bytes_limit, self.age_limit)
+
+    def evict_if_due(self):
+        if time.monotonic() - self.last_eviction >= self.eviction_interval:
+            self.evict()
+
+    def get_items(self, function: str = None) -> List[CacheItem]:
+        """
+        Get the entries stored in this cache.
+
+        :param function: name of a cached function to filter the entries
+        :return: list of cache entries
+        """
+        return get_cache_items(self.location, function)
+
+    def reduce_size(
+        self,
+        bytes_limit: Optional[int] = None,
+        age_limit: Optional[datetime.timedelta] = None,
+        function: str = None,
+    ) -> List[CacheItem]:
+        """
+        Evict entries from this cache. See prune_cache_items.
+
+        :param bytes_limit: maximum size of the cache in bytes
+        :param age_limit: maximum time since the last access of an entry
+        :param function: name of a cached function to restrict the eviction to
+        :return: list of evicted entries
+        """
+        return prune_cache_items(self.get_items(function), bytes_limit, age_limit)
+
+    def print_stats(self):
+        """
+        Print hit/miss counters and stored bytes for each cached function.
+
+        """
+        sizes = {}
+        for item in self.get_items():
+            sizes[item.function] = sizes.get(item.function, 0) + item.size
+
+        for name, func in self.functions.items():
+            total = func.hits + func.misses
+            hit_rate = func.hits / total if total > 0 else 0
+            print(
+                f"Cache {self.name}.{name}: hits={func.hits} misses={func.misses} "
+                f"({hit_rate * 100:.0f}%) bytes={sizes.get(name, 0)}"
+            )
+
+
+def get_cache_items(location: Path, function: str = None) -> List[CacheItem]:
+    """
+    Get the entries stored in a joblib cache directory.
+
+    :param location: directory where joblib stores the cache
+    :param function: name of a cached function to filter the entries
+    :return: list of cache entries
+    """
+    # Older joblib versions store the cache entries in a joblib subdirectory
+    root = Path(location)
+    if (root / "joblib").is_dir():
+        root = root / "joblib"
+
+    items = []
+    for dirpath, _, filenames in os.walk(root):
+        if "output.pkl" not in filenames:
+            continue
+
+        name = os.path.basename(os.path.dirname(dirpath))
+        if function is not None and name != function:
+            continue
+
+        output = os.path.join(dirpath, "output.pkl")
+        size = sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+        last_access = max(os.path.getatime(output), os.path.getmtime(output))
+        items.append(CacheItem(name, dirpath, size, last_access))
+    return items
+
+
+def prune_cache_items(
+    items: List[CacheItem],
+    bytes_limit: Optional[int] = None,
+    age_limit: Optional[datetime.timedelta] = None,
+) -> List[CacheItem]:
+    """
+    Evict cache entries older than the age limit, then the least recently used ones over the size limit.
+
+    :param items: list of cache entries
+    :param bytes_limit: maximum size of the entries in bytes
+    :param age_limit: maximum time since the last access of an entry
+    :return: list of evicted entries
+    """
+    items = sorted(items, key=lambda item: item.last_access)
+    evicted = []
+
+    if age_limit is not None:
+        min_access = time.time() - age_limit.total_seconds()
+        evicted.extend(item for item in items if item.last_access < min_access)
+        items = items[len(evicted) :]
+
+    if bytes_limit is not None:
+        total = sum(item.size for item in items)
+        for item in items:
+            if total <= bytes_limit:
+                break
+            evicted.append(item)
+            total -= item.size
+
+    for item in evicted:
+        shutil.rmtree(item.path, ignore_errors=True)
+    return evicted
+
+
+def print_cache_stats():
+    """
+    Print the stats of all the caches created in this process.
+
+    """
+    for cache in CACHES.values():
+        cache.print_stats()
@@ -1,13 +1,123 @@
 # coding=utf-8
+import atexit
+import queue
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import List
+
 import pandas as pd
 import pyodbc
-from pathlib import Path
-from joblib import Memory
+
+from backend.integrations.cache import ManagedCache
 
 database_home = "data\\database\\"
-memory = Memory(Path(f"{database_home}"), verbose=0)
+memory = ManagedCache("database", Path(f"{database_home}"), verbose=0)
 DB_CONFIG = Path(f"{database_home}database.config").read_text()
 
+# Max number of revisions per batched query (SQL Server accepts up to 2100 parameters)
+REVISIONS_BATCH_SIZE = 1000
+
+
+class PooledConnection:
+    """
+    Database connection that keeps one cursor per query text.
+
+    Executing the same query text again on the same cursor allows pyodbc to reuse the prepared statement.
+    """
+
+    def __init__(self, config: str):
+        self.connection = pyodbc.connect(config)
+        self.cursors = {}
+
+    def read_query(self, query: str, params: list) -> pd.DataFrame:
+        """
+        Execute a query and load its results into a dataframe.
+
+        :param query: SQL query text
+        :param params: list of query parameters
+        :return: dataframe with the query results
+        """
+        cursor = self.cursors.get(query)
+        if cursor is None:
+            cursor = self.cursors[query] = self.connection.cursor()
+
+        cursor.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+        rows = [tuple(row) for row in cursor.fetchall()]
+        return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+    def close(self):
+        for cursor in self.cursors.values():
+            cursor.close()
+        self.connection.close()
+
+
+class ConnectionPool:
+    """
+    Pool of reusable database connections, which are opened on demand and closed on exit.
+    """
+
+    def __init__(self, config: str, max_size: int = 4):
+        self.config = config
+        self.idle = queue.LifoQueue(maxsize=max_size)
+
+    @contextmanager
+    def connection(self) -> PooledConnection:
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = PooledConnection(self.config)
+
+        try:
+            yield connection
+        finally:
+            try:
+                self.idle.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+
+    def read_query(self, query: str, params: list) -> pd.DataFrame:
+        """
+        Execute a query using one of the pooled connections.
+
+        :param query: SQL query text
+        :param params: list of query parameters
+        :return: dataframe with the query results
+        """
+        with self.connection() as connection:
+            return connection.read_query(query, params)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+    def reset_after_fork(self):
+        """
+        Forget the idle connections inherited from the parent process, without closing them (the parent
+        process still uses them).
+
+        """
+        self.idle = queue.LifoQueue(maxsize=self.idle.maxsize)
+
+
+pool = ConnectionPool(DB_CONFIG)
+atexit.register(pool.close)
+
+# Query results fetched in batch, waiting to be stored in the cache of get_testfails_for_revision
+_prefetched_testfails = {}
+
+
+@lru_cache()
+def load_query(name: str) -> str:
+    """
+    Load the text of a SQL query file from the database home directory.
+
+    :param name: name of the query file (without the .sql extension)
+    :return: SQL query text
+    """
+    return Path(f"{database_home}{name}.sql").read_text()
+
 
 @memory.cache
 def get_test_name_fails(start_date: str, max_date: str) -> pd.DataFrame:
@@ -19,9 +129,7 @@ def get_test_name_fails(start_date: str, max_date: str) -> pd.DataFrame:
     :return: 2-columns dataframe with the tests names and number of fails
     """
     print("Querying database for test name fails")
-    query = Path(f"{database_home}test_name_fails.sql").read_text()
-    connection = pyodbc.connect(DB_CONFIG)
-    return pd.read_sql_query(query, connection, params=[start_date, max_date])
+    return pool.read_query(load_query("test_name_fails"), [start_date, max_date])
 
 
 @memory.cache
@@ -32,10 +140,47 @@ def get_testfails_for_revision(revision: str) -> pd.DataFrame:
     :param revision: revision id
     :return: 1-column dataframe with the test names
     """
+    prefetched = _prefetched_testfails.pop(str(revision), None)
+    if prefetched is not None:
+        return prefetched
+
     print(f"Querying db for test fails for rev {revision}")
-    query = Path(f"{database_home}test_fails_rev.sql").read_text()
-    connection = pyodbc.connect(DB_CONFIG)
-    return pd.read_sql_query(query, connection, params=[revision])
+    return pool.read_query(load_query("test_fails_rev"), [revision])
+
+
+def get_testfails_for_revisions(revisions: List[str]):
+    """
+    Query the database for the tests that failed on a list of revisions, using batched queries.
+
+    Only revisions missing from the cache of get_testfails_for_revision are queried.
+    The cache is then populated with the results for each one of those revisions.
+
+    :param revisions: list of revision ids
+    """
+    missing = [
+        revision
+        for revision in revisions
+        if not get_testfails_for_revision.check_call_in_cache(revision=revision)
+    ]
+
+    for start in range(0, len(missing), REVISIONS_BATCH_SIZE):
+        batch = missing[start : start + REVISIONS_BATCH_SIZE]
+        print(f"Querying db for test fails for {len(batch)} revisions")
+        placeholders = ", ".join("?" for _ in batch)
+        query = load_query("test_fails_revs").format(revisions=placeholders)
+        results = pool.read_query(query, batch)
+
+        # Split results by revision, keeping the columns of the single revision query
+        columns = results.columns.drop("REVISION")
+        revisions_results = {
+            str(revision): rev_results[columns].reset_index(drop=True)
+            for revision, rev_results in results.groupby("REVISION")
+        }
+        for revision in batch:
+            _prefetched_testfails[str(revision)] = revisions_results.get(
+                str(revision), pd.DataFrame(columns=columns)
+            )
+            get_testfails_for_revision(revision=revision)
 
 
 @memory.cache
@@ -48,6 +193,4 @@ def get_test_execution_times(from_dt: str, to_dt: str) -> pd.DataFrame:
     :return: 2-columns dataframe with the tests names and test execution times
     """
     print(f"Querying db for test execution times")
-    query = Path(f"{database_home}test_execution_times.sql").read_text()
-    connection = pyodbc.connect(DB_CONFIG)
-    return pd.read_sql_query(query, connection, params=[from_dt, to_dt])
+    return pool.read_query(load_query("test_execution_times"), [from_dt, to_dt])
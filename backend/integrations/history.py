@@ -0,0 +1,307 @@
+# coding=utf-8
+import datetime
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Iterator, List
+
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS test_fails (
+    day TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    failures REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS test_fails_day ON test_fails (day);
+CREATE INDEX IF NOT EXISTS test_fails_name ON test_fails (test_name);
+
+CREATE TABLE IF NOT EXISTS execution_times (
+    day TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    execution_time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS execution_times_day ON execution_times (day);
+CREATE INDEX IF NOT EXISTS execution_times_name ON execution_times (test_name);
+
+CREATE TABLE IF NOT EXISTS revision_fails (
+    revision TEXT NOT NULL,
+    test_name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revision_fails_revision ON revision_fails (revision);
+CREATE INDEX IF NOT EXISTS revision_fails_name ON revision_fails (test_name);
+
+CREATE TABLE IF NOT EXISTS partitions (
+    metric TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (metric, key)
+);
+"""
+
+# Per-day tables of the local store for each date interval query
+DAY_TABLES = {"test_fails": "failures", "execution_times": "execution_time"}
+
+
+def to_day(date: str) -> datetime.date:
+    """
+    Convert an ISO date (or datetime) string to a date.
+
+    :param date: ISO formatted date
+    :return: date object
+    """
+    return datetime.datetime.fromisoformat(date).date()
+
+
+def get_days(start_date: str, end_date: str) -> Iterator[str]:
+    """
+    Get the ISO formatted days in the interval [start_date, end_date).
+
+    :param start_date: start date
+    :param end_date: end date (excluded)
+    :return: iterator over the days in the interval
+    """
+    day, end = to_day(start_date), to_day(end_date)
+    while day < end:
+        yield day.isoformat()
+        day += datetime.timedelta(days=1)
+
+
+class HistoryProvider(ABC):
+    """
+    Source of the build history data used by the test selection pipeline.
+
+    Date intervals are handled as [start, end), as in the queries in data/database.
+    """
+
+    @abstractmethod
+    def get_test_name_fails(self, start_date: str, max_date: str) -> pd.DataFrame:
+        """
+        Get the number of test fails on a given date interval.
+
+        :param start_date: start date
+        :param max_date: maximum date
+        :return: 2-columns dataframe with the tests names and number of fails
+        """
+
+    @abstractmethod
+    def get_testfails_for_revision(self, revision: str) -> pd.DataFrame:
+        """
+        Get the tests that failed on a given revision.
+
+        :param revision: revision id
+        :return: 1-column dataframe with the test names (FULLNAME column)
+        """
+
+    @abstractmethod
+    def get_test_execution_times(self, from_dt: str, to_dt: str) -> pd.DataFrame:
+        """
+        Get the test execution times on a given date interval.
+
+        :param from_dt: start date
+        :param to_dt: end date
+        :return: 2-columns dataframe with the tests names and test execution times
+        """
+
+    def get_testfails_for_revisions(self, revisions: List[str]):
+        """
+        Prefetch the tests that failed on a list of revisions, if supported by the provider.
+
+        :param revisions: list of revision ids
+        """
+
+
+class DatabaseHistory(HistoryProvider):
+    """
+    History provider backed by the ODBC database queries in backend.integrations.database.
+    """
+
+    def __init__(self):
+        # Imported on demand, since the module requires the database configuration file
+        from backend.integrations import database
+
+        self.database = database
+
+    def get_test_name_fails(self, start_date: str, max_date: str) -> pd.DataFrame:
+        return self.database.get_test_name_fails(start_date, max_date)
+
+    def get_testfails_for_revision(self, revision: str) -> pd.DataFrame:
+        return self.database.get_testfails_for_revision(revision=revision)
+
+    def get_test_execution_times(self, from_dt: str, to_dt: str) -> pd.DataFrame:
+        return self.database.get_test_execution_times(from_dt, to_dt)
+
+    def get_testfails_for_revisions(self, revisions: List[str]):
+        self.database.get_testfails_for_revisions(revisions)
+
+
+class SQLiteHistory(HistoryProvider):
+    """
+    History provider backed by a local SQLite store.
+
+    Date interval metrics are stored as per-day partitions, so any interval is aggregated locally.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def get_test_name_fails(self, start_date: str, max_date: str) -> pd.DataFrame:
+        return self._sum_days(
+            "test_fails", "FULLNAME", "FAILURES", start_date, max_date
+        )
+
+    def get_testfails_for_revision(self, revision: str) -> pd.DataFrame:
+        query = "SELECT test_name AS FULLNAME FROM revision_fails WHERE revision = ?"
+        return pd.read_sql_query(query, self.connection, params=[str(revision)])
+
+    def get_test_execution_times(self, from_dt: str, to_dt: str) -> pd.DataFrame:
+        return self._sum_days(
+            "execution_times", "NAME", "EXECUTION_TIME", from_dt, to_dt
+        )
+
+    def _sum_days(self, table, name_column, value_column, start_date, end_date):
+        value = DAY_TABLES[table]
+        query = (
+            f"SELECT test_name AS {name_column}, SUM({value}) AS {value_column} "
+            f"FROM {table} WHERE day >= ? AND day < ? GROUP BY test_name"
+        )
+        params = [to_day(start_date).isoformat(), to_day(end_date).isoformat()]
+        return pd.read_sql_query(query, self.connection, params=params)
+
+    def has_partition(self, metric: str, key: str) -> bool:
+        """
+        Check if the store already contains the results of a metric for a given day/revision.
+
+        :param metric: name of the metric table
+        :param key: day or revision id
+        :return: True if the partition was stored before
+        """
+        query = "SELECT 1 FROM partitions WHERE metric = ? AND key = ?"
+        return self.connection.execute(query, [metric, str(key)]).fetchone() is not None
+
+    def store_day(self, table: str, day: str, results: pd.DataFrame):
+        """
+        Store (or replace) the query results of a date interval metric for a single day.
+
+        :param table: name of the metric table
+        :param day: ISO formatted day
+        :param results: 2-columns dataframe with the tests names and metric values
+        """
+        rows = [(day, test, float(value)) for test, value in results.values]
+        with self.connection:
+            self.connection.execute(f"DELETE FROM {table} WHERE day = ?", [day])
+            self.connection.executemany(f"INSERT INTO {table} VALUES (?, ?, ?)", rows)
+            self._add_partition(table, day)
+
+    def store_revision(self, revision: str, results: pd.DataFrame):
+        """
+        Store (or replace) the failing tests of a given revision.
+
+        :param revision: revision id
+        :param results: 1-column dataframe with the test names
+        """
+        rows = [(str(revision), test) for test in results.iloc[:, 0].values]
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM revision_fails WHERE revision = ?", [str(revision)]
+            )
+            self.connection.executemany(
+                "INSERT INTO revision_fails VALUES (?, ?)", rows
+            )
+            self._add_partition("revision_fails", revision)
+
+    def _add_partition(self, metric, key):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO partitions VALUES (?, ?)", [metric, str(key)]
+        )
+
+
+class IncrementalHistory(HistoryProvider):
+    """
+    History provider that answers queries from a local store, fetching only the missing partitions from a source.
+
+    Date interval metrics are partitioned per day and revision fails per revision. Moving a date window
+    queries the source only for the days not stored yet (and for the current day, which is still incomplete).
+    """
+
+    def __init__(self, source: HistoryProvider, store: SQLiteHistory):
+        self.source = source
+        self.store = store
+
+    def get_test_name_fails(self, start_date: str, max_date: str) -> pd.DataFrame:
+        self.refresh_days(
+            "test_fails", self.source.get_test_name_fails, start_date, max_date
+        )
+        return self.store.get_test_name_fails(start_date, max_date)
+
+    def get_testfails_for_revision(self, revision: str) -> pd.DataFrame:
+        self.get_testfails_for_revisions([revision])
+        return self.store.get_testfails_for_revision(revision)
+
+    def get_test_execution_times(self, from_dt: str, to_dt: str) -> pd.DataFrame:
+        self.refresh_days(
+            "execution_times", self.source.get_test_execution_times, from_dt, to_dt
+        )
+        return self.store.get_test_execution_times(from_dt, to_dt)
+
+    def get_testfails_for_revisions(self, revisions: List[str]):
+        missing = [
+            revision
+            for revision in revisions
+            if not self.store.has_partition("revision_fails", revision)
+        ]
+        if not missing:
+            return
+
+        self.source.get_testfails_for_revisions(missing)
+        print(f"Storing test fails for {len(missing)} revisions")
+        for revision in missing:
+            results = self.source.get_testfails_for_revision(revision)
+            self.store.store_revision(revision, results)
+
+    def refresh_days(self, table: str, query, start_date: str, end_date: str):
+        """
+        Fetch the missing days of a date interval metric from the source into the store.
+
+        :param table: name of the metric table
+        :param query: source query for the metric, called with a single day interval
+        :param start_date: start date
+        :param end_date: end date (excluded)
+        """
+        today = datetime.date.today().isoformat()
+        for day in get_days(start_date, end_date):
+            if day < today and self.store.has_partition(table, day):
+                continue
+            next_day = (to_day(day) + datetime.timedelta(days=1)).isoformat()
+            print(f"Storing {table} history for {day}")
+            self.store.store_day(table, day, query(day, next_day))
+
+
+def mirror_history(
+    source: HistoryProvider,
+    store: SQLiteHistory,
+    fails_start_dt: str,
+    from_dt: str,
+    to_dt: str,
+    revisions: List[str],
+):
+    """
+    Mirror the history data required by a demo configuration into a local store.
+
+    Only the days and revisions missing from the store are queried from the source.
+
+    :param source: history provider to query
+    :param store: local history store
+    :param fails_start_dt: start date for the test fails history
+    :param from_dt: start date of the evaluation period
+    :param to_dt: end date of the evaluation period
+    :param revisions: list of revision ids in the evaluation period
+    """
+    history = IncrementalHistory(source, store)
+    history.refresh_days(
+        "test_fails", source.get_test_name_fails, fails_start_dt, from_dt
+    )
+    history.refresh_days(
+        "execution_times", source.get_test_execution_times, from_dt, to_dt
+    )
+    history.get_testfails_for_revisions(revisions)
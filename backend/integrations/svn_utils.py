@@ -1,33 +1,497 @@
 # coding=utf-8
+import collections
 import datetime
 import os.path
+import re
+import sqlite3
+from collections import defaultdict
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
+import svn.exception
 import svn.local
-from joblib import Memory
 
-memory = Memory(Path("data"), verbose=1)
+LOG_STORE_PATH = Path("data") / "svn" / "log_store.db"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
 
+LogEntry = collections.namedtuple(
+    "LogEntry", ["date", "msg", "revision", "author", "changelist"]
+)
 
-@memory.cache
-def get_log(branch, from_dt, to_dt):
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_entries (
+    branch TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    date TEXT,
+    author TEXT,
+    msg TEXT,
+    PRIMARY KEY (branch, revision)
+);
+CREATE INDEX IF NOT EXISTS log_entries_date ON log_entries (branch, date);
+
+CREATE TABLE IF NOT EXISTS changes (
+    branch TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_revision ON changes (branch, revision);
+
+CREATE TABLE IF NOT EXISTS fetched_ranges (
+    branch TEXT NOT NULL,
+    from_date TEXT NOT NULL,
+    to_date TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS diff_revisions (
+    branch TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    PRIMARY KEY (branch, revision)
+);
+
+CREATE TABLE IF NOT EXISTS diff_ranges (
+    branch TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS diff_ranges_revision ON diff_ranges (branch, revision);
+"""
+
+HUNK_PATTERN = re.compile(r"@@ -(\d+)(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+
+
+def to_utc(date: str) -> datetime.datetime:
+    """
+    Convert an ISO date string to an UTC datetime (dates without timezone are in local time, as in svn).
+
+    :param date: ISO formatted date
+    :return: UTC datetime
+    """
+    return datetime.datetime.fromisoformat(date).astimezone(datetime.timezone.utc)
+
+
+# Stores created before entries without a date were stored as NULL had a NOT NULL date (and an empty
+# date for those entries)
+NULL_DATES_MIGRATION = """
+BEGIN;
+ALTER TABLE log_entries RENAME TO log_entries_old;
+CREATE TABLE log_entries (
+    branch TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    date TEXT,
+    author TEXT,
+    msg TEXT,
+    PRIMARY KEY (branch, revision)
+);
+INSERT INTO log_entries
+    SELECT branch, revision, NULLIF(date, ''), author, msg FROM log_entries_old;
+DROP TABLE log_entries_old;
+CREATE INDEX log_entries_date ON log_entries (branch, date);
+COMMIT;
+"""
+
+
+def format_date(date: datetime.datetime) -> str:
+    return date.astimezone(datetime.timezone.utc).strftime(DATE_FORMAT)
+
+
+def parse_date(date: str) -> datetime.datetime:
+    return datetime.datetime.strptime(date, DATE_FORMAT).replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def parse_optional_date(date: Optional[str]) -> Optional[datetime.datetime]:
+    # Entries without a date are stored with a NULL date
+    return parse_date(date) if date is not None else None
+
+
+class SvnLogStore:
+    """
+    Local store of svn log entries and changelists, indexed by revision number.
+
+    The date ranges already fetched for each branch are tracked, so only the missing ranges are requested to svn.
+    """
+
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path))
+        self.connection.executescript(SCHEMA)
+
+        columns = self.connection.execute("PRAGMA table_info(log_entries)").fetchall()
+        if any(name == "date" and not_null for _, name, _, not_null, _, _ in columns):
+            self.connection.executescript(NULL_DATES_MIGRATION)
+
+    def get_entries(
+        self, branch: str, from_date: datetime.datetime, to_date: datetime.datetime
+    ) -> List[LogEntry]:
+        """
+        Get the stored log entries committed on a given date interval.
+
+        :param branch: path of the branch working copy
+        :param from_date: start date
+        :param to_date: end date
+        :return: list of log entries sorted by revision
+        """
+        query = (
+            "SELECT revision FROM log_entries "
+            "WHERE branch = ? AND date >= ? AND date <= ? ORDER BY revision"
+        )
+        params = [branch, format_date(from_date), format_date(to_date)]
+        revisions = [row[0] for row in self.connection.execute(query, params)]
+        return [self.get_entry(branch, revision) for revision in revisions]
+
+    def get_entry(self, branch: str, revision: int) -> Optional[LogEntry]:
+        """
+        Get the stored log entry of a given revision.
+
+        :param branch: path of the branch working copy
+        :param revision: revision number
+        :return: the log entry, or None if it is not stored
+        """
+        row = self.connection.execute(
+            "SELECT date, msg, author FROM log_entries "
+            "WHERE branch = ? AND revision = ?",
+            [branch, revision],
+        ).fetchone()
+        if row is None:
+            return None
+
+        changelist = self.connection.execute(
+            "SELECT action, path FROM changes "
+            "WHERE branch = ? AND revision = ? ORDER BY rowid",
+            [branch, revision],
+        ).fetchall()
+        date, msg, author = row
+        return LogEntry(parse_optional_date(date), msg, revision, author, changelist)
+
+    def get_max_revision(self, branch: str) -> Optional[Tuple[int, datetime.datetime]]:
+        """
+        Get the highest stored revision of a branch.
+
+        :param branch: path of the branch working copy
+        :return: revision number and date (None if the entry has no date), or None if the store has no
+        entries for the branch
+        """
+        row = self.connection.execute(
+            "SELECT revision, date FROM log_entries WHERE branch = ? "
+            "ORDER BY revision DESC LIMIT 1",
+            [branch],
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], parse_optional_date(row[1])
+
+    def add_entries(self, branch: str, entries):
+        """
+        Store (or replace) log entries and their changelists.
+
+        :param branch: path of the branch working copy
+        :param entries: iterable of svn log entries (fetched with changelist=True)
+        """
+        with self.connection:
+            for entry in entries:
+                date = format_date(entry.date) if entry.date is not None else None
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO log_entries VALUES (?, ?, ?, ?, ?)",
+                    [branch, entry.revision, date, entry.author, entry.msg],
+                )
+                self.connection.execute(
+                    "DELETE FROM changes WHERE branch = ? AND revision = ?",
+                    [branch, entry.revision],
+                )
+                self.connection.executemany(
+                    "INSERT INTO changes VALUES (?, ?, ?, ?)",
+                    [(branch, entry.revision, a, p) for a, p in entry.changelist],
+                )
+
+    def add_range(
+        self, branch: str, from_date: datetime.datetime, to_date: datetime.datetime
+    ):
+        """
+        Mark a date interval as fetched, merging it with the overlapping fetched intervals.
+
+        :param branch: path of the branch working copy
+        :param from_date: start date
+        :param to_date: end date
+        """
+        ranges = self.get_ranges(branch) + [(from_date, to_date)]
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM fetched_ranges WHERE branch = ?", [branch]
+            )
+            self.connection.executemany(
+                "INSERT INTO fetched_ranges VALUES (?, ?, ?)",
+                [(branch, format_date(s), format_date(e)) for s, e in merged],
+            )
+
+    def get_ranges(
+        self, branch: str
+    ) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+        rows = self.connection.execute(
+            "SELECT from_date, to_date FROM fetched_ranges WHERE branch = ?", [branch]
+        ).fetchall()
+        return [(parse_date(start), parse_date(end)) for start, end in rows]
+
+    def get_missing_ranges(
+        self, branch: str, from_date: datetime.datetime, to_date: datetime.datetime
+    ) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+        """
+        Get the sub-intervals of a date interval that were not fetched yet.
+
+        :param branch: path of the branch working copy
+        :param from_date: start date
+        :param to_date: end date
+        :return: list of missing date intervals
+        """
+        missing = []
+        start = from_date
+        for range_start, range_end in sorted(self.get_ranges(branch)):
+            if range_end < start:
+                continue
+            if range_start > to_date:
+                break
+            if range_start > start:
+                missing.append((start, range_start))
+            start = max(start, range_end)
+
+        if start < to_date:
+            missing.append((start, to_date))
+        return missing
+
+    def get_diff_ranges(
+        self, branch: str, revision: int
+    ) -> Optional[Dict[str, List[Tuple[int, int]]]]:
+        """
+        Get the stored changed line ranges of a revision.
+
+        :param branch: path of the branch working copy
+        :param revision: revision number
+        :return: map of file paths to changed line ranges, or None if the revision diff is not stored
+        """
+        row = self.connection.execute(
+            "SELECT 1 FROM diff_revisions WHERE branch = ? AND revision = ?",
+            [branch, revision],
+        ).fetchone()
+        if row is None:
+            return None
+
+        ranges = defaultdict(list)
+        for path, start, end in self.connection.execute(
+            "SELECT path, start, end FROM diff_ranges "
+            "WHERE branch = ? AND revision = ? ORDER BY rowid",
+            [branch, revision],
+        ):
+            ranges[path].append((start, end))
+        return dict(ranges)
+
+    def add_diff_ranges(
+        self, branch: str, revision: int, ranges: Dict[str, List[Tuple[int, int]]]
+    ):
+        """
+        Store (or replace) the changed line ranges of a revision.
+
+        :param branch: path of the branch working copy
+        :param revision: revision number
+        :param ranges: map of file paths to changed line ranges
+        """
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM diff_ranges WHERE branch = ? AND revision = ?",
+                [branch, revision],
+            )
+            self.connection.executemany(
+                "INSERT INTO diff_ranges VALUES (?, ?, ?, ?, ?)",
+                [
+                    (branch, revision, path, start, end)
+                    for path, path_ranges in ranges.items()
+                    for start, end in path_ranges
+                ],
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO diff_revisions VALUES (?, ?)",
+                [branch, revision],
+            )
+
+
+_store = None
+
+
+def get_log_store() -> SvnLogStore:
+    global _store
+    if _store is None:
+        _store = SvnLogStore(LOG_STORE_PATH)
+    return _store
+
+
+def prefetch_log(branch, from_dt, to_dt):
+    """
+    Fetch the svn log entries of a date interval that are missing from the local store.
+
+    Dates after the current time are not marked as fetched, so they are requested again later.
+
+    :param branch: path of the branch working copy
+    :param from_dt: start date (ISO format)
+    :param to_dt: end date (ISO format)
+    """
     repo_path = os.path.abspath(branch)
     client = svn.local.LocalClient(path_=repo_path)
+    store = get_log_store()
 
-    log = client.log_default(
-        timestamp_from_dt=datetime.datetime.fromisoformat(from_dt),
-        timestamp_to_dt=datetime.datetime.fromisoformat(to_dt),
-        changelist=True,
-    )
-    return [log_e for log_e in log]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    to_date = min(to_utc(to_dt), now)
+    for start, end in store.get_missing_ranges(repo_path, to_utc(from_dt), to_date):
+        print(f"Fetching svn log from {start} to {end}")
+        log = client.log_default(
+            timestamp_from_dt=start.astimezone().replace(tzinfo=None),
+            timestamp_to_dt=end.astimezone().replace(tzinfo=None),
+            changelist=True,
+        )
+        store.add_entries(repo_path, log)
+        store.add_range(repo_path, start, end)
 
 
-@memory.cache()
-def get_log_for_revision(branch, revision):
+def update_log_tail(branch):
+    """
+    Fetch the svn log entries newer than the highest revision in the local store.
+
+    :param branch: path of the branch working copy
+    """
     repo_path = os.path.abspath(branch)
     client = svn.local.LocalClient(path_=repo_path)
+    store = get_log_store()
 
-    log = client.log_default(
-        revision_from=revision, revision_to=revision, changelist=True
+    max_revision = store.get_max_revision(repo_path)
+    if max_revision is None:
+        return
+
+    revision, date = max_revision
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        log = list(client.log_default(revision_from=revision + 1, changelist=True))
+    except svn.exception.SvnException:
+        # No revisions after the highest stored one
+        log = []
+    store.add_entries(repo_path, log)
+    if date is not None:
+        store.add_range(repo_path, date, now)
+
+
+def get_log(branch, from_dt, to_dt):
+    prefetch_log(branch, from_dt, to_dt)
+    return get_log_store().get_entries(
+        os.path.abspath(branch), to_utc(from_dt), to_utc(to_dt)
     )
-    return [log_e for log_e in log]
+
+
+def get_log_for_revision(branch, revision):
+    repo_path = os.path.abspath(branch)
+    store = get_log_store()
+    revision = int(revision)
+
+    entry = store.get_entry(repo_path, revision)
+    if entry is None:
+        max_revision = store.get_max_revision(repo_path)
+        if max_revision is not None and revision > max_revision[0]:
+            update_log_tail(branch)
+            entry = store.get_entry(repo_path, revision)
+
+    if entry is None:
+        client = svn.local.LocalClient(path_=repo_path)
+        log = client.log_default(
+            revision_from=revision, revision_to=revision, changelist=True
+        )
+        store.add_entries(repo_path, log)
+        entry = store.get_entry(repo_path, revision)
+
+    return [entry] if entry is not None else []
+
+
+def get_changed_lines(branch, revision) -> Optional[Dict[str, List[Tuple[int, int]]]]:
+    """
+    Get the line ranges changed by a revision (with svn diff -c), in the line numbers of the previous
+    version of each file.
+
+    :param branch: path of the branch working copy
+    :param revision: revision number
+    :return: map of file paths (relative to the working copy) to changed line ranges, or None if the
+    diff is not available (i.e. changes are mapped at the file level)
+    """
+    repo_path = os.path.abspath(branch)
+    store = get_log_store()
+    revision = int(revision)
+
+    ranges = store.get_diff_ranges(repo_path, revision)
+    if ranges is None:
+        client = svn.local.LocalClient(path_=repo_path)
+        try:
+            diff = client.run_command("diff", ["-c", str(revision)], wd=repo_path)
+        except svn.exception.SvnException as e:
+            print(f"Failed to get svn diff for revision {revision}: {e}")
+            return None
+        ranges = parse_diff_ranges(diff)
+        store.add_diff_ranges(repo_path, revision, ranges)
+    return ranges
+
+
+def parse_diff_ranges(diff_lines) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Parse the changed line ranges of each file of an unified diff, in the line numbers of the old file.
+
+    Removed/modified lines are mapped to their old line numbers. Added lines are mapped to the old lines
+    around their insertion point. Lines outside the hunks (e.g. svn property changes) are ignored.
+
+    :param diff_lines: lines of the svn diff output
+    :return: map of file paths to changed line ranges
+    """
+    ranges = defaultdict(list)
+
+    def add_range(start, end):
+        path_ranges = ranges[path]
+        if path_ranges and start <= path_ranges[-1][1] + 1:
+            path_ranges[-1] = (path_ranges[-1][0], max(end, path_ranges[-1][1]))
+        else:
+            path_ranges.append((start, end))
+
+    # Current old line number and lines left of the current hunk (old/new file)
+    path, old_line, old_left, new_left = None, None, 0, 0
+    for line in diff_lines:
+        if line.startswith("Index: "):
+            path, old_line = line[len("Index: ") :].strip(), None
+        elif line.startswith("Property changes on:"):
+            old_line = None
+        elif line.startswith("@@"):
+            re_search = HUNK_PATTERN.match(line)
+            old_line = int(re_search.group(1)) if re_search else None
+            if re_search:
+                old_left = int(re_search.group(2) or 1)
+                new_left = int(re_search.group(3) or 1)
+        elif path is None or old_line is None or line.startswith("\\"):
+            # File headers and "No newline at end of file" markers
+            continue
+        elif line.startswith("-"):
+            add_range(old_line, old_line)
+            old_line += 1
+            old_left -= 1
+        elif line.startswith("+"):
+            add_range(max(old_line - 1, 1), max(old_line, 1))
+            new_left -= 1
+        else:
+            old_line += 1
+            old_left -= 1
+            new_left -= 1
+
+        if old_line is not None and old_left <= 0 and new_left <= 0:
+            # End of the hunk
+            old_line = None
+
+    return dict(ranges)
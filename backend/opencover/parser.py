@@ -1,182 +1,322 @@
 # coding=utf-8
 import xml.etree.ElementTree as ET
 import json
-import itertools
+import hashlib
+import os
 import re
+from collections import namedtuple
+
 import numpy as np
 
 import backend.opencover.utils as utils
 
+FileRecord = namedtuple("FileRecord", ["uid", "path"])
+TestRecord = namedtuple("TestRecord", ["uid", "name"])
+MethodRecord = namedtuple("MethodRecord", ["name", "file_ref", "tests", "lines"])
 
-def get_modules_from_report(report):
-    """
-    Extracts maps for tests and code modules names to its XML elements.
-
-    :param report: path to XML coverage report
-    :return: 2 maps (tests and code) mapping a module name to its XML element
-    """
-    _, root_modules = ET.parse(report).getroot()
-    test_modules, code_modules = {}, {}
-
-    for child in root_modules:
-        name = utils.get_module_name(child)
-        code_modules[name] = child
-        if "Tests" in name:
-            test_modules[name] = child
+# Binary activity matrix (test x method) stored as the coordinates of the active cells
+SparseActivityMatrix = namedtuple("SparseActivityMatrix", ["rows", "cols", "shape"])
 
-    return test_modules, code_modules
+# Translation of binary cell values (0/1 bytes) to their JSON digits
+JSON_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
 
+# Return type and method name around the namespace of a method full name
+METHOD_NAME_PATTERN = re.compile(r"(.* ).*(::.*)")
 
-def get_files_map_from_report(report, branch):
-    """
-    Get map between file uids and their file path name.
 
-    :param report: path to the XML coverage report
-    :param branch: branch name to locate the start of the file path
-    :return: map between file uids and file path names
+def iter_report(report):
     """
-    test_modules, code_modules = get_modules_from_report(report)
-    files_map = {}
+    Stream the records of a XML coverage report, clearing each element as soon as it is processed.
 
-    for module in code_modules.values():
-        for file in utils.get_module_files(module):
-            uid, path = file.attrib["uid"], file.attrib["fullPath"]
-            re_search = re.search(branch + r"\\(.*)\.cs", path)
-            if re_search:
-                name = re_search.group(1).replace("\\", ".")
-                files_map[uid] = name
+    The emitted records are:
+        - FileRecord: uid and path of each file of a module
+        - TestRecord: uid and name of each tracked method (test) of a test module
+        - MethodRecord: name, file ref uid, covering tests uids (None if not covered) and
+          first/last source lines (None if unknown) of each method
 
-    return files_map
+    :param report: path to XML coverage report
+    :return: iterator over the report records
+    """
+    module_name = None
+    for _, element in ET.iterparse(report, events=("end",)):
+        tag = element.tag
+        if tag == "ModuleName":
+            module_name = element.text
+        elif tag == "File":
+            yield FileRecord(element.attrib["uid"], element.attrib["fullPath"])
+        elif tag == "TrackedMethod":
+            if module_name is not None and "Tests" in module_name:
+                yield TestRecord(element.attrib["uid"], element.attrib["name"])
+        elif tag == "Method":
+            yield get_method_record(element)
+            element.clear()
+        elif tag == "Class":
+            element.clear()
+        elif tag == "Module":
+            module_name = None
+            element.clear()
+
+
+def get_method_record(method):
+    """
+    Extract the record of a method XML element.
 
+    :param method: method XML element
+    :return: record with the method name, file ref uid, covering tests uids and source lines range
+    """
+    file_ref = utils.get_method_file_ref(method)
+    if file_ref is not None:
+        file_ref = file_ref.attrib["uid"]
+    _, tests = utils.get_method_coverage(method)
+    return MethodRecord(
+        utils.get_method_name(method), file_ref, tests, utils.get_method_lines(method)
+    )
 
-def build_tests_map(test_modules_map):
-    tests_uids_map = {}
 
-    for module in test_modules_map.values():
-        for method in utils.get_module_tracked_methods(module):
-            uid, name = method.attrib["uid"], method.attrib["name"]
-            tests_uids_map[uid] = name
+def process_report(report, branch):
+    """
+    Build the files, tests and methods maps and the id-activity matrix of a report in a single traversal.
 
-    return tests_uids_map
+    Methods and tests ids are derived from their names (see get_method_id/get_test_id), so the results
+    of reports parsed independently can be merged without coordination.
+    Methods with the same fully qualified name share the same id and their covering tests are joined.
 
+    :param report: path to the XML coverage report
+    :param branch: branch name to locate the start of the file paths
+    :return: files map, tests map, methods map, id-activity matrix (method id -> tests ids) and
+             methods lines map (method id -> first/last source lines)
+    """
+    files_map, tests_uids_map, methods_map, id_act_matrix = {}, {}, {}, {}
+    methods_lines = {}
+    file_pattern = re.compile(branch + r"\\(.*)\.cs")
+
+    for record in iter_report(report):
+        if isinstance(record, MethodRecord):
+            # Replace method namespace with containing file path, if known
+            method_name = get_fixed_method_name(files_map, record.file_ref, record.name)
+            if method_name is None:
+                method_name = record.name
+
+            method_id = get_method_id(method_name)
+            methods_map[method_id] = method_name
+            tests = id_act_matrix.setdefault(method_id, [])
+            if record.tests is not None:
+                tests.extend(record.tests)
+            if record.lines is not None:
+                start, end = methods_lines.get(method_id, record.lines)
+                methods_lines[method_id] = [
+                    min(start, record.lines[0]),
+                    max(end, record.lines[1]),
+                ]
+        elif isinstance(record, FileRecord):
+            re_search = file_pattern.search(record.path)
+            if re_search:
+                files_map[record.uid] = re_search.group(1).replace("\\", ".")
+        elif isinstance(record, TestRecord):
+            tests_uids_map[record.uid] = record.name
 
-def build_methods_map(code_modules):
-    methods_uids_map = {}
-    counter = itertools.count(1)
+    # Translate the report tests uids to tests ids (tests not in the tests map are ignored)
+    tests_ids = {uid: get_test_id(name) for uid, name in tests_uids_map.items()}
+    tests_map = {tests_ids[uid]: name for uid, name in tests_uids_map.items()}
+    for method_id, tests in id_act_matrix.items():
+        id_act_matrix[method_id] = [tests_ids[uid] for uid in tests if uid in tests_ids]
 
-    for module in code_modules.values():
-        for clazz in utils.get_module_classes(module):
-            for method in utils.get_class_methods(clazz):
-                method_name = utils.get_method_name(method)
-                methods_uids_map["m" + str(next(counter))] = method_name
+    return files_map, tests_map, methods_map, id_act_matrix, methods_lines
 
-    return methods_uids_map
 
+def get_method_id(method_name):
+    """
+    Get the stable id of a method, derived from a hash of its fully qualified name.
 
-def build_id_activity_matrix(code_modules, methods_uids_map, files_map):
-    # id-activity matrix
-    #    key   - method id
-    #    value - test id
-    def get_method_id(method_name):
-        for (key, value) in methods_uids_map.items():
-            if value == method_name:
-                return key
+    :param method_name: method name
+    :return: method id
+    """
+    return "m" + hashlib.sha1(method_name.encode("utf-8")).hexdigest()[:16]
 
-    activity_matrix = dict.fromkeys(methods_uids_map.keys(), [])
 
-    for module in code_modules.values():
-        for clazz in utils.get_module_classes(module):
-            for method in utils.get_class_methods(clazz):
-                method_name, tests = utils.get_method_coverage(method)
-                if method_name is not None:
-                    method_id = get_method_id(method_name)
-                    activity_matrix[method_id] = tests
-                    # Update methods map with namespace fix
-                    fix_methods_map_namespace(
-                        files_map, method, method_id, method_name, methods_uids_map
-                    )
+def get_test_id(test_name):
+    """
+    Get the stable id of a test, derived from a hash of its name.
 
-    return activity_matrix
+    :param test_name: test name
+    :return: test id
+    """
+    return "t" + hashlib.sha1(test_name.encode("utf-8")).hexdigest()[:16]
 
 
-def fix_methods_map_namespace(
-    files_map, method, method_id, method_name, methods_uids_map
-):
+def get_fixed_method_name(files_map, file_ref, method_name):
     """
     Replace method namespace with containing file path.
 
     :param files_map: map of uids to file paths
-    :param method: method XML element
-    :param method_id: method uid
+    :param file_ref: uid of the method file
     :param method_name: method name
-    :param methods_uids_map: map of uids to method names
+    :return: method name with the file path namespace, or None if the file is unknown
     """
-    file_ref = utils.get_method_file_ref(method)
-    if file_ref is not None:
-        file_ref = file_ref.attrib["uid"]
-        if files_map.get(file_ref) is not None:
-            return_type, name = re.search(r"(.* ).*(::.*)", method_name).groups()
-            new_namespace = files_map[file_ref]
-            new_method_name = "".join([return_type, new_namespace, name])
-            methods_uids_map[method_id] = new_method_name
+    if file_ref is None or files_map.get(file_ref) is None:
+        return None
+
+    re_search = METHOD_NAME_PATTERN.search(method_name)
+    if re_search is None:
+        return None
 
+    return_type, name = re_search.groups()
+    return "".join([return_type, files_map[file_ref], name])
 
-def build_binary_activity_matrix(id_act_matrix, method_uid_map, test_uid_map):
-    binary_activity_matrix = []
-    tests_index = list(test_uid_map.keys())
-    methods_index = list(method_uid_map.keys())
 
-    # Fill with empty cells
-    for _ in range(len(test_uid_map.keys())):
-        row = [0 for _ in range(len(method_uid_map.keys()))]
-        binary_activity_matrix.append(row)
+def build_binary_activity_matrix(id_act_entries, method_uid_map, test_uid_map):
+    """
+    Build the binary activity matrix (test x method) in coordinate format.
+
+    :param id_act_entries: iterable of id-activity entries (method id, tests uids)
+    :param method_uid_map: map of uids to method names (matrix columns)
+    :param test_uid_map: map of uids to test names (matrix rows)
+    :return: sparse activity matrix with the coordinates of the active cells
+    """
+    tests_pos = {test: pos for pos, test in enumerate(test_uid_map.keys())}
+    methods_pos = {method: pos for pos, method in enumerate(method_uid_map.keys())}
 
-    # Fill with activity results
-    for method, tests in id_act_matrix.items():
+    # Fill with activity results (tests not in the tests map are ignored)
+    rows, cols = [], []
+    for method, tests in id_act_entries:
         if method is not None and tests is not None:
-            method_pos = methods_index.index(method)
+            method_pos = methods_pos[method]
             for test in tests:
-                try:
-                    test_pos = tests_index.index(test)
-                    binary_activity_matrix[test_pos][method_pos] = 1
-                except ValueError:
-                    pass
+                test_pos = tests_pos.get(test)
+                if test_pos is not None:
+                    rows.append(test_pos)
+                    cols.append(method_pos)
 
-    return binary_activity_matrix
+    return SparseActivityMatrix(
+        np.array(rows, dtype=np.int64),
+        np.array(cols, dtype=np.int64),
+        (len(tests_pos), len(methods_pos)),
+    )
 
 
 def filter_activity_matrix(activity_matrix, method_uid_map, test_uid_map):
+    """
+    Filter the methods and tests without activity from a sparse activity matrix.
+
+    :param activity_matrix: sparse activity matrix
+    :param method_uid_map: map of uids to method names (matrix columns)
+    :param test_uid_map: map of uids to test names (matrix rows)
+    :return: filtered binary activity matrix (dense), methods map and tests map
+    """
     # Load data before filters
-    array_act_matrix = np.array(activity_matrix, dtype=bool)
+    rows, cols, (n_tests, n_methods) = activity_matrix
     tests_index = np.array(list(test_uid_map.keys()))
     methods_index = np.array(list(method_uid_map.keys()))
-    print(f"-- Before filters: {array_act_matrix.shape}")
+    print(f"-- Before filters: {(n_tests, n_methods)}")
 
     # Filter methods without activity
-    active_methods = ~np.all(array_act_matrix == 0, axis=0)
-    array_act_matrix = array_act_matrix[:, active_methods]
+    active_methods = np.bincount(cols, minlength=n_methods) > 0
     methods_index = methods_index[active_methods]
     filtered_method_uid_map = {k: method_uid_map[k] for k in methods_index}
-    print(f"-- After methods filter: {array_act_matrix.shape}")
+    print(f"-- After methods filter: {(n_tests, len(methods_index))}")
 
     # Filter tests without activity
-    active_tests = ~np.all(array_act_matrix == 0, axis=1)
+    active_tests = np.bincount(rows, minlength=n_tests) > 0
     tests_index = tests_index[active_tests]
     filtered_test_uid_map = {k: test_uid_map[k] for k in tests_index}
-    array_act_matrix = array_act_matrix[active_tests]
+
+    # Only the filtered matrix is allocated as a dense array
+    new_rows = np.cumsum(active_tests) - 1
+    new_cols = np.cumsum(active_methods) - 1
+    array_act_matrix = np.zeros((len(tests_index), len(methods_index)), dtype=bool)
+    array_act_matrix[new_rows[rows], new_cols[cols]] = True
     print(f"-- After tests filter: {array_act_matrix.shape}")
 
     return array_act_matrix, filtered_method_uid_map, filtered_test_uid_map
 
 
+def update_activity_matrix(
+    activity_matrix,
+    method_uid_map,
+    test_uid_map,
+    id_act_entries,
+    new_method_uid_map,
+    new_test_uid_map,
+    replaced_tests,
+):
+    """
+    Replace the rows of a set of tests in a binary activity matrix with new activity results.
+
+    New methods/tests are appended to the matrix. Only the methods active on the replaced rows and the
+    new methods/tests are checked for activity by the filters, since the other ones are still active.
+
+    :param activity_matrix: binary activity matrix (dense)
+    :param method_uid_map: map of uids to method names (matrix columns)
+    :param test_uid_map: map of uids to test names (matrix rows)
+    :param id_act_entries: iterable of new id-activity entries (method id, tests ids)
+    :param new_method_uid_map: map of uids to method names of the new activity results
+    :param new_test_uid_map: map of uids to test names of the new activity results
+    :param replaced_tests: set of tests ids whose rows are replaced
+    :return: updated binary activity matrix, methods map and tests map
+    """
+    print(f"-- Before update: {activity_matrix.shape}")
+    methods_map = dict(method_uid_map)
+    methods_map.update(
+        sorted((k, v) for k, v in new_method_uid_map.items() if k not in method_uid_map)
+    )
+    tests_map = {
+        k: new_test_uid_map.get(k, v)
+        for k, v in test_uid_map.items()
+        if k not in replaced_tests or k in new_test_uid_map
+    }
+    tests_map.update(
+        sorted((k, v) for k, v in new_test_uid_map.items() if k not in test_uid_map)
+    )
+    tests_pos = {test: pos for pos, test in enumerate(tests_map.keys())}
+
+    # Copy the kept rows of the current matrix
+    kept_rows = [i for i, k in enumerate(test_uid_map) if k not in replaced_tests]
+    replaced_rows = [i for i, k in enumerate(test_uid_map) if k in replaced_tests]
+    array_act_matrix = np.zeros((len(tests_map), len(methods_map)), dtype=bool)
+    array_act_matrix[
+        [tests_pos[k] for k in test_uid_map if k not in replaced_tests],
+        : len(method_uid_map),
+    ] = activity_matrix[kept_rows]
+
+    # Fill the replaced/new rows with the new activity results
+    new_act_matrix = build_binary_activity_matrix(
+        id_act_entries, methods_map, new_test_uid_map
+    )
+    new_rows = np.array([tests_pos[k] for k in new_test_uid_map], dtype=np.int64)
+    array_act_matrix[new_rows[new_act_matrix.rows], new_act_matrix.cols] = True
+
+    # Filter methods/tests that may have lost all their activity
+    candidate_methods = np.union1d(
+        np.flatnonzero(activity_matrix[replaced_rows].any(axis=0)),
+        np.arange(len(method_uid_map), len(methods_map)),
+    ).astype(np.int64)
+    active_methods = np.ones(len(methods_map), dtype=bool)
+    active_methods[candidate_methods] = array_act_matrix[:, candidate_methods].any(
+        axis=0
+    )
+    active_tests = np.ones(len(tests_map), dtype=bool)
+    active_tests[new_rows] = array_act_matrix[new_rows].any(axis=1)
+
+    array_act_matrix = array_act_matrix[active_tests][:, active_methods]
+    methods_index = np.array(list(methods_map.keys()))[active_methods]
+    tests_index = np.array(list(tests_map.keys()))[active_tests]
+    print(f"-- After update: {array_act_matrix.shape}")
+
+    return (
+        array_act_matrix,
+        {k: methods_map[k] for k in methods_index},
+        {k: tests_map[k] for k in tests_index},
+    )
+
+
 def export_data_to_json(output_name, activity_matrix, methods_map, tests_map):
     """
-        Exports processed data to json files
+    Exports processed data to json files
 
-        :param output_name: name identifier for the JSON output files
-        :param tests_map: map of ids to tests
-        :param methods_map: map of ids to methods
-        :param activity_matrix: binary activity matrix (test x method)
+    :param output_name: name identifier for the JSON output files
+    :param tests_map: map of ids to tests
+    :param methods_map: map of ids to methods
+    :param activity_matrix: binary activity matrix (test x method)
     """
     with open(f"data/jsons/testids_{output_name}.json", "w") as outfile:
         json.dump(tests_map, outfile, indent=4)
@@ -184,5 +324,98 @@ def export_data_to_json(output_name, activity_matrix, methods_map, tests_map):
     with open(f"data/jsons/methodids_{output_name}.json", "w") as outfile:
         json.dump(methods_map, outfile, indent=4)
 
+    # Written row by row (same format as json.dump), without building the matrix as a list of lists
     with open(f"data/jsons/actmatrix_{output_name}.json", "w") as outfile:
-        json.dump(activity_matrix.astype("int").tolist(), outfile)
+        outfile.write("[")
+        for i, row in enumerate(activity_matrix):
+            if i > 0:
+                outfile.write(", ")
+            digits = np.asarray(row, dtype=np.uint8).tobytes().translate(JSON_DIGITS)
+            outfile.write(f"[{', '.join(digits.decode('ascii'))}]")
+        outfile.write("]")
+
+
+def import_data_from_json(output_name):
+    """
+    Imports the processed data exported to json files
+
+    :param output_name: name identifier for the JSON output files
+    :return: binary activity matrix (test x method), map of ids to methods and map of ids to tests
+    """
+    with open(f"data/jsons/testids_{output_name}.json") as tests_file:
+        tests_map = json.load(tests_file)
+
+    with open(f"data/jsons/methodids_{output_name}.json") as methods_file:
+        methods_map = json.load(methods_file)
+
+    with open(f"data/jsons/actmatrix_{output_name}.json") as matrix_file:
+        activity_matrix = np.array(json.load(matrix_file), dtype=bool)
+
+    shape = (len(tests_map), len(methods_map))
+    return activity_matrix.reshape(shape), methods_map, tests_map
+
+
+def export_methods_lines(output_name, methods_lines):
+    """
+    Exports the source lines range of the methods to a json file
+
+    :param output_name: name identifier for the JSON output files
+    :param methods_lines: map of method ids to first/last source lines
+    """
+    with open(f"data/jsons/methodlines_{output_name}.json", "w") as outfile:
+        json.dump(methods_lines, outfile)
+
+
+def import_methods_lines(output_name):
+    """
+    Imports the source lines range of the methods
+
+    :param output_name: name identifier for the JSON output files
+    :return: map of method ids to first/last source lines (empty if there is no methods lines file)
+    """
+    path = f"data/jsons/methodlines_{output_name}.json"
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as lines_file:
+        return json.load(lines_file)
+
+
+def export_manifest(output_name, manifest):
+    """
+    Exports the manifest of the coverage reports used to build the activity matrix
+
+    :param output_name: name identifier for the JSON output files
+    :param manifest: map of report paths (relative and normalized) to their content hash and tests ids
+    """
+    with open(f"data/jsons/manifest_{output_name}.json", "w") as outfile:
+        json.dump(manifest, outfile, indent=4)
+
+
+def import_manifest(output_name):
+    """
+    Imports the manifest of the coverage reports used to build the activity matrix
+
+    :param output_name: name identifier for the JSON output files
+    :return: map of report paths to their content hash and tests ids (empty if there is no manifest)
+    """
+    path = f"data/jsons/manifest_{output_name}.json"
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def get_file_hash(path):
+    """
+    Get the sha1 hash of a file content.
+
+    :param path: path to the file
+    :return: hex digest of the file content
+    """
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
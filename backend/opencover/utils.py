@@ -2,26 +2,6 @@
 """ Helper methods to access xml elements """
 
 
-def get_module_name(module):
-    return next(module.iter("ModuleName")).text
-
-
-def get_module_tracked_methods(module):
-    return next(module.iter("TrackedMethods"))
-
-
-def get_module_classes(module):
-    return next(module.iter("Classes"))
-
-
-def get_module_files(module):
-    return next(module.iter("Files"))
-
-
-def get_class_methods(clazz):
-    return next(clazz.iter("Methods"))
-
-
 def get_method_name(method):
     return next(method.iter("Name")).text
 
@@ -45,3 +25,20 @@ def get_method_coverage(method):
     tests_uids = list(map(lambda x: x.attrib["uid"], tracked_refs))
 
     return [get_method_name(method), tests_uids]
+
+
+def get_method_lines(method):
+    # Get first and last lines of the method sequence points (or method point)
+    points = list(method.iter("SequencePoint"))
+    if not points:
+        points = [
+            point
+            for point in method.iter("MethodPoint")
+            if "sl" in point.attrib and "el" in point.attrib
+        ]
+    if not points:
+        return None
+
+    start = min(int(point.attrib["sl"]) for point in points)
+    end = max(int(point.attrib["el"]) for point in points)
+    return [start, end]
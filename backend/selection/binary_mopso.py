@@ -26,6 +26,8 @@ class BMOPSO(ParticleSwarmOptimization):
         termination_criterion: TerminationCriterion,
         swarm_generator: Generator = store.default_generator,
         swarm_evaluator: Evaluator = store.default_evaluator,
+        random_generator=random,
+        numpy_generator=numpy.random,
     ):
 
         super(BMOPSO, self).__init__(problem=problem, swarm_size=swarm_size)
@@ -37,6 +39,9 @@ class BMOPSO(ParticleSwarmOptimization):
 
         self.mutation_operator = mutation
 
+        self.random = random_generator
+        self.numpy_random = numpy_generator
+
         self.leaders = leaders
 
         self.epsilon = epsilon
@@ -97,11 +102,11 @@ class BMOPSO(ParticleSwarmOptimization):
             best_particle = copy(swarm[i].attributes["local_best"])
             best_global = self.select_global_best()
 
-            r1 = round(random.uniform(self.r1_min, self.r1_max), 1)
-            r2 = round(random.uniform(self.r2_min, self.r2_max), 1)
-            c1 = round(random.uniform(self.c1_min, self.c1_max), 1)
-            c2 = round(random.uniform(self.c2_min, self.c2_max), 1)
-            w = round(random.uniform(self.weight_min, self.weight_max), 1)
+            r1 = round(self.random.uniform(self.r1_min, self.r1_max), 1)
+            r2 = round(self.random.uniform(self.r2_min, self.r2_max), 1)
+            c1 = round(self.random.uniform(self.c1_min, self.c1_max), 1)
+            c2 = round(self.random.uniform(self.c2_min, self.c2_max), 1)
+            w = round(self.random.uniform(self.weight_min, self.weight_max), 1)
 
             for var in range(swarm[i].number_of_variables):
                 best_particle_diff = numpy.subtract(
@@ -130,7 +135,7 @@ class BMOPSO(ParticleSwarmOptimization):
 
     def compute_position(self, speed):
         updated_positions = (
-            numpy.random.random_sample(speed.shape) < self._sigmoid(speed)
+            self.numpy_random.random_sample(speed.shape) < self._sigmoid(speed)
         ) * 1
         return list(numpy.array(updated_positions, dtype=bool))
 
@@ -159,7 +164,7 @@ class BMOPSO(ParticleSwarmOptimization):
         leaders = self.leaders.solution_list
 
         if len(leaders) > 2:
-            particles = random.sample(leaders, 2)
+            particles = self.random.sample(leaders, 2)
 
             if self.leaders.comparator.compare(particles[0], particles[1]) < 1:
                 best_global = copy(particles[0])
@@ -1,7 +1,10 @@
 # coding=utf-8
+import hashlib
 import json
+import os
 import re
-from typing import List
+from bisect import bisect_right
+from typing import FrozenSet, Iterable, List, Tuple
 
 import pandas as pd
 from collections import defaultdict
@@ -9,7 +12,7 @@ from dataclasses import dataclass
 
 import numpy as np
 
-from backend.integrations import database
+from backend.integrations.history import DatabaseHistory, HistoryProvider
 
 
 def normalize_test_name(tests: np.ndarray):
@@ -43,6 +46,75 @@ def normalize_iterative_test_name(test: str):
     return test
 
 
+class TestNameIndex:
+    """
+    Index of test names to find which of them are contained in another test name, i.e. the matches of
+    any(x in test for x in names), without scanning all the names.
+
+    The names are kept in a hash set (for the exact and canonical keys of a test, e.g. the name of an
+    iterative test without its suffix) and in a sorted array, where the names that are a prefix of each
+    suffix of a test are found by binary search.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.names = set(names)
+        self.sorted_names = sorted(self.names)
+        self.first_chars = {name[0] for name in self.names if name}
+        self.matches = {}
+
+    def contains_any(self, test: str) -> bool:
+        """
+        Check if any of the indexed names is contained in a test name.
+
+        :param test: test name
+        :return: True if any name is a substring of the test name
+        """
+        if test in self.names or normalize_iterative_test_name(test) in self.names:
+            return True
+        return len(self.find_all(test)) > 0
+
+    def find_all(self, test: str) -> FrozenSet[str]:
+        """
+        Get all the indexed names contained in a test name (memoized for each test name).
+
+        :param test: test name
+        :return: set of names that are a substring of the test name
+        """
+        found = self.matches.get(test)
+        if found is None:
+            found = set()
+            if "" in self.names:
+                found.add("")
+            for start in range(len(test)):
+                if test[start] in self.first_chars:
+                    found.update(self.find_prefixes(test[start:]))
+            found = self.matches[test] = frozenset(found)
+        return found
+
+    def find_prefixes(self, text: str) -> List[str]:
+        """
+        Get the (non-empty) indexed names that are a prefix of a text.
+
+        :param text: text to search
+        :return: list of names that are a prefix of the text
+        """
+        prefixes = []
+        while text:
+            # The closest name not greater than the text is either a prefix of it, or any prefix of
+            # the text must also be a prefix of their longest common prefix
+            position = bisect_right(self.sorted_names, text)
+            if position == 0:
+                break
+            candidate = self.sorted_names[position - 1]
+            if text.startswith(candidate):
+                if candidate:
+                    prefixes.append(candidate)
+                text = candidate[:-1]
+            else:
+                text = text[: len(os.path.commonprefix([candidate, text]))]
+        return prefixes
+
+
 def get_historical_metric_map(query_results: pd.DataFrame) -> dict:
     """
     Convert 2-columns query results to a dictionary mapping the test name to the historical metric value
@@ -57,6 +129,193 @@ def get_historical_metric_map(query_results: pd.DataFrame) -> dict:
     return history_metric_map
 
 
+def load_activity_data(activity_matrix):
+    """
+    Load an activity matrix JSON file and the tests/methods maps exported with it.
+
+    :param activity_matrix: path of the activity matrix JSON file
+    :return: binary activity matrix, array of (normalized) test names and methods map
+    """
+    print(f"Loading json data from {activity_matrix}")
+    # Find relative path and timestamp to load tests/methods maps
+    actm_pattern = r"(.*)\\actmatrix_(.*)\.json"
+    path, timestamp = re.search(actm_pattern, activity_matrix).groups()
+
+    # activity matrix
+    with open(activity_matrix) as actm_file:
+        matrix = np.array(json.load(actm_file), dtype=bool)
+
+    # tests
+    with open(f"{path}\\testids_{timestamp}.json") as tests_file:
+        tests = np.array(list(json.load(tests_file).values()))
+        tests_index = np.array(list(normalize_test_name(tests)))
+
+    # methods
+    with open(f"{path}\\methodids_{timestamp}.json") as methods_file:
+        methods_map = json.load(methods_file)
+
+    return matrix, tests_index, methods_map
+
+
+def get_activity_data_version(
+    matrix: np.ndarray, tests_index: np.ndarray, methods_index: np.ndarray
+) -> str:
+    """
+    Get a version id of the activity data, i.e. a hash of the matrix content and its tests/methods names.
+
+    :param matrix: binary activity matrix
+    :param tests_index: array of the test names of the matrix rows
+    :param methods_index: array of the method names of the matrix columns
+    :return: hex digest of the activity data
+    """
+    version = hashlib.sha1(str(matrix.shape).encode("utf-8"))
+    version.update(np.packbits(matrix).tobytes())
+    for name in [*tests_index, *methods_index]:
+        version.update(name.encode("utf-8") + b"\n")
+    return version.hexdigest()
+
+
+def get_activity_data_paths(activity_matrix) -> List[str]:
+    """
+    Get the paths of the JSON files exported with an activity matrix (the methods lines file may not exist).
+
+    :param activity_matrix: path of the activity matrix JSON file
+    :return: list with the paths of the activity matrix, tests map, methods map and methods lines files
+    """
+    actm_pattern = r"(.*)\\actmatrix_(.*)\.json"
+    path, timestamp = re.search(actm_pattern, activity_matrix).groups()
+    return [
+        activity_matrix,
+        f"{path}\\testids_{timestamp}.json",
+        f"{path}\\methodids_{timestamp}.json",
+        f"{path}\\methodlines_{timestamp}.json",
+    ]
+
+
+def load_methods_lines(activity_matrix):
+    """
+    Load the methods lines JSON file exported with an activity matrix, if available.
+
+    :param activity_matrix: path of the activity matrix JSON file
+    :return: map of method ids to first/last source lines (empty if there is no methods lines file)
+    """
+    actm_pattern = r"(.*)\\actmatrix_(.*)\.json"
+    path, timestamp = re.search(actm_pattern, activity_matrix).groups()
+    lines_path = f"{path}\\methodlines_{timestamp}.json"
+    if not os.path.exists(lines_path):
+        return {}
+
+    with open(lines_path) as lines_file:
+        return json.load(lines_file)
+
+
+def get_changed_lines_map(changed_lines: dict) -> dict:
+    """
+    Convert the file paths of changed line ranges (as in svn diff) to dot notation (as in the methods map).
+
+    :param changed_lines: map of file paths to changed line ranges
+    :return: map of .cs file paths in dot notation to changed line ranges
+    """
+    return {
+        re.sub(r"\.cs$", "", path).replace("\\", "/").replace("/", "."): ranges
+        for path, ranges in changed_lines.items()
+        if path.endswith(".cs")
+    }
+
+
+def filter_changelist(changelist: List[List], ignore_changes: List) -> List[List]:
+    """
+    Filter the changes to ignored file paths from a changelist.
+
+    :param changelist: list of changed files (each element is pair with the type of change and the filename)
+    :param ignore_changes: list of file paths to be ignored
+    :return: filtered changelist
+    """
+    return [
+        change
+        for change in changelist
+        if not any(
+            (ignore in change[1]) or (change[1] == "/platform/trunk")
+            for ignore in ignore_changes
+        )
+    ]
+
+
+def get_changed_files(changelist: List[List], branch: str) -> List[Tuple[str, str]]:
+    """
+    Get the changed .cs files (excluding *.xaml.cs files) of a changelist.
+
+    :param changelist: list of changed files (each element is pair with the type of change and the filename)
+    :param branch: branch name to locate the start of the file paths
+    :return: list of pairs with the type of change and the file path in dot notation (as in the methods map)
+    """
+    changed_files = []
+    cs_pattern = branch + r"/(.*)\.cs$"
+    xaml_cs_pattern = branch + r"/(.*)xaml\.cs"
+    for x in changelist:
+        if re.search(cs_pattern, x[1]):
+            # Check if it's not a *.xaml.cs file
+            if not re.search(xaml_cs_pattern, x[1]):
+                filename = re.search(cs_pattern, x[1]).group(1)
+                changed_files.append((x[0], filename.replace("/", ".")))
+    return changed_files
+
+
+def get_changed_indexes(
+    methods_map: dict,
+    methods_index: np.ndarray,
+    changed_files: List[str],
+    changed_lines: dict = None,
+    methods_lines: dict = None,
+) -> List[int]:
+    """
+    Map changed files to the indexes of their methods in the activity matrix.
+
+    If the changed line ranges are given, only the methods whose source lines intersect them are mapped.
+    Methods without known source lines and files without known changed lines fall back to the file level.
+
+    :param methods_map: map of ids to method names
+    :param methods_index: array of the method names of the activity matrix columns
+    :param changed_files: list of changed file paths in dot notation
+    :param changed_lines: map of changed file paths in dot notation to changed line ranges
+    :param methods_lines: map of method ids to first/last source lines
+    :return: list of changed method indexes
+    """
+    if changed_lines is None:
+        changed_lines = {}
+    if methods_lines is None:
+        methods_lines = {}
+
+    changed_indexes = []
+    for method_id, method in methods_map.items():
+        matched_files = [changed for changed in changed_files if changed in method]
+        if matched_files and any(
+            is_method_changed(methods_lines.get(method_id), changed_lines.get(changed))
+            for changed in matched_files
+        ):
+            matched_methods = np.where(methods_index == method)
+            changed_indexes.append(matched_methods[0][0])
+    return changed_indexes
+
+
+def is_method_changed(method_lines, changed_ranges) -> bool:
+    """
+    Check if a method of a changed file is changed, i.e. if its source lines intersect the changed lines.
+
+    :param method_lines: first/last source lines of the method (None if unknown)
+    :param changed_ranges: changed line ranges of the file (None if unknown)
+    :return: True if the method lines intersect the changed lines (or if any of them is unknown)
+    """
+    if method_lines is None or changed_ranges is None:
+        return True
+
+    start, end = method_lines
+    return any(
+        range_start <= end and start <= range_end
+        for range_start, range_end in changed_ranges
+    )
+
+
 @dataclass
 class ProblemData:
     original_matrix: np.ndarray
@@ -66,11 +325,16 @@ class ProblemData:
     tests_index: np.ndarray
     methods_index: np.ndarray
     methods_map: dict
+    methods_lines: dict
+    matrix_version: str
+    tests_name_index: TestNameIndex
+    history_window: tuple
     history_test_fails: dict
     history_test_execution_times: dict
     new_files: dict
     branch: str
     ignore_tests: list
+    history: HistoryProvider
 
     swarm_size: int
 
@@ -82,28 +346,34 @@ class ProblemData:
         from_date,
         to_date,
         ignore_tests=None,
+        history=None,
     ):
         """
         ProblemData initialization.
 
         - Load JSON data for an activity matrix file
         - Filter tests with no activity (zero rows)
+        - Load historical data from the history provider (by default, the database)
         :param activity_matrix_path: path of the activity matrix JSON file
         """
         if ignore_tests is None:
             ignore_tests = []
+        if history is None:
+            history = DatabaseHistory()
         self.branch = branch
         self.ignore_tests = ignore_tests
+        self.history = history
+        self.history_window = (fails_start_date, from_date, to_date)
 
         self.load_json_data(activity_matrix_path)
         self.filter_tests_with_no_activity()
 
         # Load historical data
         self.history_test_fails = get_historical_metric_map(
-            database.get_test_name_fails(fails_start_date, from_date)
+            history.get_test_name_fails(fails_start_date, from_date)
         )
         self.history_test_execution_times = get_historical_metric_map(
-            database.get_test_execution_times(from_date, to_date)
+            history.get_test_execution_times(from_date, to_date)
         )
 
         self.new_files = {}
@@ -119,28 +389,18 @@ class ProblemData:
 
         :param activity_matrix: path of the activity matrix JSON file
         """
-        print(f"Loading json data from {activity_matrix}")
-        # Find relative path and timestamp to load tests/methods maps
-        actm_pattern = r"(.*)\\actmatrix_(.*)\.json"
-        path, timestamp = re.search(actm_pattern, activity_matrix).groups()
-
-        # activity matrix
-        with open(activity_matrix) as actm_file:
-            self.activity_matrix = np.array(json.load(actm_file), dtype=bool)
-            self.original_matrix = self.activity_matrix
-
-        # tests
-        with open(f"{path}\\testids_{timestamp}.json") as tests_file:
-            tests = np.array(list(json.load(tests_file).values()))
-            self.tests_index = np.array(list(normalize_test_name(tests)))
-            self.original_tests = self.tests_index
-
-        # methods
-        with open(f"{path}\\methodids_{timestamp}.json") as methods_file:
-            self.methods_map = json.load(methods_file)
-            # print(f"methods map: {len(self.methods_map.keys())}")
-            self.methods_index = np.array(list(self.methods_map.values()))
-            self.original_methods = self.methods_index
+        self.activity_matrix, self.tests_index, self.methods_map = load_activity_data(
+            activity_matrix
+        )
+        self.original_matrix = self.activity_matrix
+        self.original_tests = self.tests_index
+        self.methods_index = np.array(list(self.methods_map.values()))
+        self.original_methods = self.methods_index
+        self.methods_lines = load_methods_lines(activity_matrix)
+        self.matrix_version = get_activity_data_version(
+            self.original_matrix, self.original_tests, self.original_methods
+        )
+        self.tests_name_index = TestNameIndex(self.original_tests)
 
     def reset(self):
         """
@@ -181,46 +441,47 @@ class ProblemData:
         self.filter_tests_with_no_activity()
         self.filter_methods_with_no_activity()
 
-    def get_changed_indexes_for_changelist(
+    def track_new_files(
         self, changelist: List[List], ignore_changes: List
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Get the changed .cs files of a changelist, storing the added ones as new files.
+
+        :param changelist: list of changed files (each element is pair with the type of change and the filename)
+        :param ignore_changes: list of file paths to be ignored
+        :return: lists of changed files and of new (or modified new) files, in dot notation
+        """
+        # Filter changelist before processing
+        changelist = filter_changelist(changelist, ignore_changes)
+
+        new_files = []
+        changed_files = []
+        for change_type, dot_filename in get_changed_files(changelist, self.branch):
+            changed_files.append(dot_filename)
+            # Check if new file and store in hash table
+            if change_type == "A":
+                self.new_files[dot_filename] = 123
+                new_files.append(dot_filename)
+            # Check if modified an already known new file
+            elif self.new_files.get(dot_filename) is not None:
+                new_files.append(dot_filename)
+        return changed_files, new_files
+
+    def get_changed_indexes_for_changelist(
+        self, changelist: List[List], ignore_changes: List, changed_lines: dict = None
     ) -> object:
         """
         Get the changed method indexes in the activity matrix based on the changelist
 
         :param changelist: list of changed files (each element is pair with the type of change and the filename)
         :param ignore_changes: list of file paths to be ignored
+        :param changed_lines: map of file paths to changed line ranges (from svn diff) to only map the
+                              changed methods of each file, instead of all its methods
         :return: on success, returns a list of changed indexes in the activity matrix.
                  on failure, returns a string describing the error case
         """
-        # Filter changelist before processing
-        changelist = [
-            change
-            for change in changelist
-            if not any(
-                (ignore in change[1]) or (change[1] == "/platform/trunk")
-                for ignore in ignore_changes
-            )
-        ]
-
         # Process changelist
-        new_files = []
-        changed_files = []
-        cs_pattern = self.branch + r"/(.*)\.cs$"
-        xaml_cs_pattern = self.branch + r"/(.*)xaml\.cs"
-        for x in changelist:
-            if re.search(cs_pattern, x[1]):
-                # Check if it's not a *.xaml.cs file
-                if not re.search(xaml_cs_pattern, x[1]):
-                    filename = re.search(cs_pattern, x[1]).group(1)
-                    dot_filename = filename.replace("/", ".")
-                    changed_files.append(dot_filename)
-                    # Check if new file and store in hash table
-                    if x[0] == "A":
-                        self.new_files[dot_filename] = 123
-                        new_files.append(dot_filename)
-                    # Check if modified an already known new file
-                    elif self.new_files.get(dot_filename) is not None:
-                        new_files.append(dot_filename)
+        changed_files, new_files = self.track_new_files(changelist, ignore_changes)
 
         # Check if no .cs files were changed
         if not changed_files:
@@ -231,11 +492,15 @@ class ProblemData:
             return "[Error] Changelist contains only new files or modified new files"
 
         # Map files to method indexes
-        changed_indexes = []
-        for method in self.methods_map.values():
-            if any(changed in method for changed in changed_files):
-                matched_methods = np.where(self.methods_index == method)
-                changed_indexes.append(matched_methods[0][0])
+        if changed_lines is not None:
+            changed_lines = get_changed_lines_map(changed_lines)
+        changed_indexes = get_changed_indexes(
+            self.methods_map,
+            self.methods_index,
+            changed_files,
+            changed_lines,
+            self.methods_lines,
+        )
 
         # Check if there are no method indexes to return
         if not changed_indexes:
@@ -0,0 +1,171 @@
+# coding=utf-8
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from jmetal.core.solution import BinarySolution
+
+from backend.integrations.cache import CacheItem, prune_cache_items
+from backend.selection.problem_data import ProblemData
+
+# Default size limit for the results cache
+DEFAULT_MAX_MB = 512
+
+# Name of the file storing the front of each cache entry
+FRONT_FILE = "front.npz"
+
+
+def get_run_key(
+    data: ProblemData, changed_idxs: List[int], objectives: List, seed: int
+) -> str:
+    """
+    Get the key of an optimizer run, i.e. a hash of its inputs.
+
+    :param data: problem data of the run
+    :param changed_idxs: indexes of the methods changed by the commit
+    :param objectives: list of objective functions
+    :param seed: random seed of the optimizer runs
+    :return: hex digest identifying the run
+    """
+    key = {
+        "matrix": data.matrix_version,
+        "changed": sorted(set(int(idx) for idx in changed_idxs)),
+        "objectives": [func.__name__ for func in objectives],
+        "swarm_size": data.swarm_size,
+        "seed": seed,
+        "history": list(data.history_window),
+    }
+    return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def get_run_seed(key: str) -> int:
+    """
+    Get the random seed of an optimizer run from its key.
+
+    Runs are seeded from their own inputs, so the results of a run don't depend on the runs before it
+    (e.g. on whether they were answered from the results cache).
+
+    :param key: key of the run (see get_run_key)
+    :return: 32 bits seed
+    """
+    return int(key[:8], 16)
+
+
+class ResultCache:
+    """
+    Persistent cache of the solution fronts found by the optimizer for a given changeset.
+
+    Entries are keyed by the run key (see get_run_key), a hash of the activity data version, the set of
+    changed methods (matrix columns), the objectives, the swarm size, the random seed and the history
+    window. Each front is stored as the
+    objectives values and a bitset over the selected tests. Least recently used entries are evicted when
+    the cache is over its size limit.
+    """
+
+    def __init__(self, location: str, max_mb: float = DEFAULT_MAX_MB):
+        """
+        ResultCache initialization.
+
+        :param location: directory where the entries are stored
+        :param max_mb: maximum size of the cache in MB
+        """
+        self.location = Path(location)
+        self.location.mkdir(parents=True, exist_ok=True)
+        self.bytes_limit = int(max_mb * 1024 ** 2)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, tests_index: np.ndarray) -> Optional[List[BinarySolution]]:
+        """
+        Load the solution front stored for a key.
+
+        :param key: cache key of the run
+        :param tests_index: array of the test names of the filtered matrix rows
+        :return: list of solutions, or None if the key is not cached (or doesn't match the tests)
+        """
+        path = self.location / key / FRONT_FILE
+        try:
+            with np.load(path) as front:
+                tests, bits, objectives = (
+                    front["tests"],
+                    front["bits"],
+                    front["objectives"],
+                )
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        if not np.array_equal(tests, tests_index):
+            self.misses += 1
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        self.hits += 1
+
+        solutions = []
+        for solution_bits, solution_objectives in zip(bits, objectives):
+            solution = BinarySolution(
+                number_of_variables=1, number_of_objectives=len(solution_objectives)
+            )
+            variables = np.unpackbits(solution_bits, count=len(tests)).astype(bool)
+            solution.variables[0] = variables.tolist()
+            solution.objectives = solution_objectives.tolist()
+            solutions.append(solution)
+        return solutions
+
+    def put(self, key: str, tests_index: np.ndarray, front: List[BinarySolution]):
+        """
+        Store the solution front of a run, evicting the least recently used entries over the size limit.
+
+        :param key: cache key of the run
+        :param tests_index: array of the test names of the filtered matrix rows
+        :param front: list of solutions found by the optimizer
+        """
+        if not front:
+            return
+
+        entry = self.location / key
+        entry.mkdir(exist_ok=True)
+        tmp_path = entry / "front.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            tests=np.asarray(tests_index, dtype=str),
+            bits=np.array(
+                [np.packbits(np.array(s.variables[0], dtype=bool)) for s in front]
+            ).reshape(len(front), -1),
+            objectives=np.array([s.objectives for s in front], dtype=float),
+        )
+        os.replace(tmp_path, entry / FRONT_FILE)
+
+        prune_cache_items(self.get_items(), self.bytes_limit)
+
+    def get_items(self) -> List[CacheItem]:
+        """
+        Get the entries stored in this cache.
+
+        :return: list of cache entries
+        """
+        items = []
+        for entry in self.location.iterdir():
+            path = entry / FRONT_FILE
+            if path.is_file():
+                stat = path.stat()
+                items.append(
+                    CacheItem("results", str(entry), stat.st_size, stat.st_mtime)
+                )
+        return items
+
+    def print_stats(self):
+        """
+        Print hit/miss counters of the cache.
+
+        """
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total > 0 else 0
+        print(
+            f"Result cache: hits={self.hits} misses={self.misses} ({hit_rate * 100:.0f}%)"
+        )
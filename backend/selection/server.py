@@ -0,0 +1,401 @@
+# coding=utf-8
+import copy
+import datetime
+import json
+import math
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+
+import numpy as np
+
+from backend.integrations.svn_utils import (
+    get_changed_lines,
+    get_log_for_revision,
+    prefetch_log,
+)
+from backend.selection.problem_data import ProblemData
+from backend.selection.test_selection import TestSelection, my_binary_mopso
+
+
+class SelectionRequestError(Exception):
+    """
+    Invalid test selection request, reported back to the client with a 400 status.
+    """
+
+
+@dataclass
+class Snapshot:
+    generation: int
+    data: ProblemData
+    loaded_at: str
+
+
+def get_files_signature(paths: List[str]) -> tuple:
+    """
+    Get the modification time and size of a list of files (None for missing files).
+
+    :param paths: list of file paths
+    :return: tuple with the (mtime, size) of each file
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class SelectionServer:
+    """
+    Test selection service that keeps the problem data loaded across requests.
+
+    Optimizer runs are executed in a bounded pool of workers. Requests over the pool and queue
+    capacity are rejected instead of being queued indefinitely. Each run draws from its own random
+    generators, so concurrent requests don't change the results of each other.
+
+    If a loader is given, the watched files (activity matrix bundle, history store, etc.) are polled and
+    a new problem data snapshot is built in the background when they change. The new snapshot replaces the
+    current one atomically: requests already running finish with the snapshot they started with.
+    """
+
+    def __init__(
+        self,
+        data: ProblemData,
+        objectives_map: dict,
+        branch_path: str,
+        ignore_changes: list,
+        workers: int = 2,
+        queue_size: int = 8,
+        line_level: bool = False,
+        loader: Callable[[], ProblemData] = None,
+        watch_paths: List[str] = None,
+        reload_interval: float = 30,
+        seed: int = None,
+    ):
+        """
+        SelectionServer initialization.
+
+        :param data: problem data loaded for the activity matrix and history
+        :param objectives_map: map of objective names to objective functions
+        :param branch_path: path of the branch working copy (to get the svn log/diff of a revision)
+        :param ignore_changes: list of file paths to be ignored
+        :param workers: number of optimizer runs executed in parallel
+        :param queue_size: number of requests waiting for a worker before new ones are rejected
+        :param line_level: only map the changed methods of each file, using svn diff
+        :param loader: function that builds a new problem data (None to disable reloads)
+        :param watch_paths: list of files that trigger a reload when changed
+        :param reload_interval: seconds between checks of the watched files
+        :param seed: random seed of the optimizer runs (None for a different seed for each request)
+        """
+        self.snapshot = Snapshot(1, data, datetime.datetime.now().isoformat())
+        self.objectives_map = objectives_map
+        self.branch_path = branch_path
+        self.ignore_changes = ignore_changes
+        self.line_level = line_level
+        self.seed = seed
+
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        # The svn log store is a SQLite connection, so all svn lookups are done by the same thread
+        self.svn_pool = ThreadPoolExecutor(max_workers=1)
+
+        self.loader = loader
+        self.watch_paths = watch_paths if watch_paths is not None else []
+        self.reload_interval = reload_interval
+        self.stopped = threading.Event()
+
+    def submit(self, request: dict):
+        """
+        Schedule a test selection request in the workers pool.
+
+        :param request: test selection request
+        :return: future with the response, or None if the pool and queue are full
+        """
+        if not self.slots.acquire(blocking=False):
+            return None
+
+        future = self.pool.submit(self.select, request)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def select(self, request: dict) -> dict:
+        """
+        Run the test selection pipeline for a request.
+
+        The request is a dictionary with:
+            - revision (revision id) or changelist (list of [type of change, filename] pairs)
+            - objectives (list of objective names)
+            - time_budget (optional, maximum seconds of the optimizer run)
+            - swarm_size (optional, defaults to the swarm size of the problem data)
+
+        :param request: test selection request
+        :return: response with the solutions found (or the reason why there are none)
+        """
+        self.validate(request)
+        objectives = request["objectives"]
+        # Keep the same snapshot until the end of the request, even if a reload happens meanwhile
+        snapshot = self.snapshot
+        time_budget = request.get("time_budget")
+        # Missing and null fields get the defaults
+        swarm_size = request.get("swarm_size") or snapshot.data.swarm_size
+        seed = self.seed if self.seed is not None else random.getrandbits(32)
+
+        revision, changelist, changed_lines = self.svn_pool.submit(
+            self.get_changes, request
+        ).result()
+
+        # Shallow copy, so concurrent requests don't filter the matrices of each other
+        data = copy.copy(snapshot.data)
+        data.reset()
+        data.new_files = {}
+
+        response = {
+            "revision": revision,
+            "objectives": objectives,
+            "generation": snapshot.generation,
+        }
+        changed_idxs = data.get_changed_indexes_for_changelist(
+            changelist, self.ignore_changes, changed_lines
+        )
+        if type(changed_idxs) == str:
+            response["error_no_changed_items"] = changed_idxs
+            response["solutions"] = []
+            return response
+
+        data.filter_data_for_commit(changed_idxs)
+        problem = TestSelection(
+            data, [self.objectives_map[o] for o in objectives], seed=seed
+        )
+        algorithm = my_binary_mopso(problem, int(swarm_size), time_budget)
+        algorithm.run()
+        front = sorted(algorithm.get_result(), key=lambda x: x.objectives)
+
+        response["computing_time"] = algorithm.total_computing_time
+        response["solutions"] = [
+            {
+                "objectives": [float(value) for value in solution.objectives],
+                "tests": list(data.tests_index[np.array(solution.variables[0])]),
+            }
+            for solution in front
+        ]
+        return response
+
+    def validate(self, request: dict):
+        """
+        Check the types and values of the fields of a test selection request (see select).
+
+        :param request: test selection request
+        """
+        if not isinstance(request, dict):
+            raise SelectionRequestError("request must be a JSON object")
+
+        objectives = request.get("objectives")
+        if (
+            not isinstance(objectives, list)
+            or not objectives
+            or any(
+                not isinstance(o, str) or o not in self.objectives_map
+                for o in objectives
+            )
+        ):
+            raise SelectionRequestError(
+                f"objectives must be a non-empty subset of {list(self.objectives_map)}"
+            )
+
+        time_budget = request.get("time_budget")
+        if time_budget is not None and (not is_number(time_budget) or time_budget <= 0):
+            raise SelectionRequestError(
+                "time_budget must be a positive number of seconds"
+            )
+
+        swarm_size = request.get("swarm_size")
+        if swarm_size is not None and (
+            not is_number(swarm_size) or swarm_size != int(swarm_size) or swarm_size < 1
+        ):
+            raise SelectionRequestError("swarm_size must be a positive integer")
+
+        changelist = request.get("changelist")
+        if changelist is not None:
+            if not isinstance(changelist, list) or any(
+                not isinstance(change, list)
+                or len(change) != 2
+                or not all(isinstance(value, str) for value in change)
+                for change in changelist
+            ):
+                raise SelectionRequestError(
+                    "changelist must be a list of [type of change, filename] pairs"
+                )
+        else:
+            revision = request.get("revision")
+            if revision is None:
+                raise SelectionRequestError(
+                    "request must have a revision or a changelist"
+                )
+            if not (
+                (is_number(revision) and revision == int(revision))
+                or (isinstance(revision, str) and revision.isdigit())
+            ):
+                raise SelectionRequestError("revision must be a revision number")
+
+    def watch(self):
+        """
+        Poll the watched files and reload the problem data when they change, until the server stops.
+
+        A reload only starts once the files are unchanged for a whole interval, so files still being
+        written are not loaded. If the reload fails, the current snapshot is kept.
+        """
+        loaded = get_files_signature(self.watch_paths)
+        previous = loaded
+        while not self.stopped.wait(self.reload_interval):
+            current = get_files_signature(self.watch_paths)
+            if current != loaded and current == previous:
+                print(
+                    f"Reloading problem data (generation {self.snapshot.generation + 1})"
+                )
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Failed to reload problem data: {type(e).__name__}: {e}")
+                # Loading may also write the watched files (e.g. refreshing the history store)
+                current = get_files_signature(self.watch_paths)
+                loaded = current
+            previous = current
+
+    def reload(self):
+        """
+        Build a new problem data snapshot with the loader and replace the current one.
+
+        """
+        data = self.loader()
+        self.snapshot = Snapshot(
+            self.snapshot.generation + 1, data, datetime.datetime.now().isoformat()
+        )
+        print(f"Loaded problem data generation {self.snapshot.generation}")
+
+    def prefetch_log(self, from_dt: str, to_dt: str):
+        """
+        Store the svn log of a date interval locally, so revision lookups don't need svn.
+
+        :param from_dt: start date
+        :param to_dt: end date
+        """
+        self.svn_pool.submit(prefetch_log, self.branch_path, from_dt, to_dt).result()
+
+    def get_changes(self, request: dict):
+        """
+        Get the changelist (and changed lines, in line level mode) of a request.
+
+        :param request: test selection request
+        :return: revision id (None for changelist requests), changelist and changed lines
+        """
+        if request.get("changelist") is not None:
+            return None, request["changelist"], None
+
+        revision = request["revision"]
+        log = get_log_for_revision(self.branch_path, revision)
+        if not log:
+            raise SelectionRequestError(f"revision {revision} not found")
+
+        changed_lines = (
+            get_changed_lines(self.branch_path, log[0].revision)
+            if self.line_level
+            else None
+        )
+        return log[0].revision, log[0].changelist, changed_lines
+
+    def serve(self, port: int, host: str = "localhost"):
+        """
+        Serve test selection requests over HTTP until interrupted.
+
+        POST /select with a JSON request (see select) returns a JSON response.
+        GET /health returns the generation and number of tests and methods of the current snapshot.
+
+        :param port: port to listen on
+        :param host: host to listen on (localhost by default)
+        """
+        server = ThreadingHTTPServer((host, port), make_handler(self))
+        if self.loader is not None and self.reload_interval > 0:
+            threading.Thread(target=self.watch, daemon=True).start()
+
+        print(f"Serving test selection on http://{host}:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            server.server_close()
+            self.pool.shutdown()
+            self.svn_pool.shutdown()
+
+
+def is_number(value) -> bool:
+    # JSON numbers only (no booleans, NaN or infinity)
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and math.isfinite(value)
+    )
+
+
+def make_handler(selection_server: SelectionServer):
+    """
+    Create a request handler class bound to a selection server.
+
+    :param selection_server: selection server to handle the requests
+    :return: request handler class
+    """
+
+    class SelectionHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/health":
+                return self.send_json(404, {"error": f"unknown path {self.path}"})
+
+            snapshot = selection_server.snapshot
+            self.send_json(
+                200,
+                {
+                    "generation": snapshot.generation,
+                    "loaded_at": snapshot.loaded_at,
+                    "tests": len(snapshot.data.original_tests),
+                    "methods": len(snapshot.data.methods_map),
+                },
+            )
+
+        def do_POST(self):
+            if self.path != "/select":
+                return self.send_json(404, {"error": f"unknown path {self.path}"})
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                return self.send_json(400, {"error": f"invalid JSON request: {e}"})
+
+            future = selection_server.submit(request)
+            if future is None:
+                return self.send_json(503, {"error": "server busy, try again later"})
+
+            try:
+                self.send_json(200, future.result())
+            except SelectionRequestError as e:
+                self.send_json(400, {"error": str(e)})
+            except Exception as e:
+                self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def send_json(self, status: int, body: dict):
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return SelectionHandler
@@ -2,19 +2,44 @@
 import random
 from typing import List
 
+import numpy as np
 from jmetal.core.problem import BinaryProblem
 from jmetal.core.solution import BinarySolution
 from jmetal.operator import BitFlipMutation
 from jmetal.util.archive import CrowdingDistanceArchive
-from jmetal.util.termination_criterion import StoppingByEvaluations
+from jmetal.util.termination_criterion import (
+    StoppingByEvaluations,
+    TerminationCriterion,
+)
 
 from backend.selection.binary_mopso import BMOPSO
 from backend.selection.problem_data import ProblemData
+from backend.selection.timing import StageTimer
 
 
 class TestSelection(BinaryProblem):
-    def __init__(self, problem_data: ProblemData, objectives: List):
+    def __init__(
+        self,
+        problem_data: ProblemData,
+        objectives: List,
+        timer: StageTimer = None,
+        seed: int = None,
+    ):
         super(TestSelection, self).__init__()
+        # Runs with a seed draw from their own generators, instead of the global random/numpy state
+        # shared with other runs (e.g. concurrent server requests)
+        if seed is None:
+            self.random, self.numpy_random = random, np.random
+        else:
+            self.random, self.numpy_random = (
+                random.Random(seed),
+                np.random.RandomState(seed),
+            )
+        # Objective evaluations are timed and counted per objective, if a timer is given
+        if timer is not None:
+            objectives = [
+                timer.wrap(f"objective.{func.__name__}", func) for func in objectives
+            ]
         self.objectives = objectives
         self.activity_matrix = problem_data.activity_matrix
         self.tests_index = problem_data.tests_index
@@ -37,14 +62,14 @@ class TestSelection(BinaryProblem):
         return "Test Selection Problem"
 
     def create_solution(self) -> BinarySolution:
-        random.seed(123)
+        self.random.seed(123)
         new_solution = BinarySolution(
             number_of_variables=self.number_of_variables,
             number_of_objectives=self.number_of_objectives,
         )
 
         new_solution.variables[0] = [
-            True if random.randint(0, 1) == 0 else False
+            True if self.random.randint(0, 1) == 0 else False
             for _ in range(self.number_of_tests)
         ]
 
@@ -55,12 +80,42 @@ class TestSelection(BinaryProblem):
         return solution
 
 
-def my_binary_mopso(problem: TestSelection, swarm):
+class StoppingByEvaluationsOrTime(TerminationCriterion):
+    """
+    Termination criterion met after a maximum number of evaluations or a maximum computing time.
+    """
+
+    def __init__(self, max_evaluations: int, max_seconds: float):
+        super(StoppingByEvaluationsOrTime, self).__init__()
+        self.max_evaluations = max_evaluations
+        self.max_seconds = max_seconds
+        self.evaluations = 0
+        self.seconds = 0.0
+
+    def update(self, *args, **kwargs):
+        self.evaluations = kwargs["EVALUATIONS"]
+        self.seconds = kwargs["COMPUTING_TIME"]
+
+    @property
+    def is_met(self):
+        return (
+            self.evaluations >= self.max_evaluations or self.seconds >= self.max_seconds
+        )
+
+
+def my_binary_mopso(problem: TestSelection, swarm, time_budget: float = None):
+    if time_budget is None:
+        termination_criterion = StoppingByEvaluations(max=2000)
+    else:
+        termination_criterion = StoppingByEvaluationsOrTime(2000, time_budget)
+
     return BMOPSO(
         problem=problem,
         swarm_size=swarm,
         epsilon=0.075,
         mutation=BitFlipMutation(probability=0),
         leaders=CrowdingDistanceArchive(100),
-        termination_criterion=StoppingByEvaluations(max=2000),
+        termination_criterion=termination_criterion,
+        random_generator=problem.random,
+        numpy_generator=problem.numpy_random,
     )
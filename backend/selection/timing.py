@@ -0,0 +1,89 @@
+# coding=utf-8
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import wraps
+
+# Shared no-op context manager returned by disabled timers
+_NO_SPAN = nullcontext()
+
+
+class Span:
+    """
+    Context manager that adds its elapsed time to a named span of a StageTimer.
+    """
+
+    def __init__(self, timer: "StageTimer", name: str):
+        self.timer = timer
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class StageTimer:
+    """
+    Accumulates the elapsed time of named pipeline stages (spans) and event counters.
+
+    A disabled timer records nothing: its spans are a shared no-op context manager and wrapped
+    functions are returned unchanged.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.spans = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    def span(self, name: str):
+        """
+        Measure the elapsed time of a with block.
+
+        :param name: name of the span
+        :return: context manager measuring the block
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return Span(self, name)
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] += seconds
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def wrap(self, name: str, func):
+        """
+        Wrap a function to measure its elapsed time and count its calls under the same name.
+
+        :param name: name of the span and counter
+        :param func: function to be measured
+        :return: measured function (or the function itself, if the timer is disabled)
+        """
+        if not self.enabled:
+            return func
+
+        @wraps(func)
+        def measured(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.spans[name] += time.perf_counter() - start
+                self.counters[name] += 1
+
+        return measured
+
+    def export(self) -> dict:
+        """
+        Export the recorded spans (in seconds) and counters.
+
+        :return: dictionary with the spans and counters maps
+        """
+        return {"spans": dict(self.spans), "counters": dict(self.counters)}
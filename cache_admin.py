@@ -0,0 +1,69 @@
+# coding=utf-8
+import datetime
+from collections import defaultdict
+
+import click
+
+from backend.integrations.cache import get_cache_items, prune_cache_items
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("inspect")
+@click.argument("cache_dir", type=click.Path(exists=True))
+@click.option("--function", "-f", help="Only show the entries of this function")
+def inspect_cache(cache_dir, function):
+    """
+    Print the number of entries, size and last access of each function in a joblib cache directory
+    (e.g. data\\database\\ or data\\).
+
+    :param cache_dir: joblib cache directory
+    :param function: name of a cached function to filter the entries
+    """
+    functions = defaultdict(list)
+    for item in get_cache_items(cache_dir, function):
+        functions[item.function].append(item)
+
+    for name, items in sorted(functions.items()):
+        size = sum(item.size for item in items) / 1024 ** 2
+        last_access = datetime.datetime.fromtimestamp(
+            max(item.last_access for item in items)
+        )
+        print(
+            f"{name}: {len(items)} entries, {size:.1f} MB (last access: {last_access})"
+        )
+
+
+@cli.command("prune")
+@click.argument("cache_dir", type=click.Path(exists=True))
+@click.option("--function", "-f", help="Only prune the entries of this function")
+@click.option("--max-mb", type=click.FLOAT, help="Maximum size of the cache in MB")
+@click.option(
+    "--max-age-days", type=click.FLOAT, help="Maximum days since the last access"
+)
+def prune_cache(cache_dir, function, max_mb, max_age_days):
+    """
+    Evict the least recently used entries of a joblib cache directory over the given limits.
+
+    :param cache_dir: joblib cache directory
+    :param function: name of a cached function to restrict the eviction to
+    :param max_mb: maximum size of the cache in MB
+    :param max_age_days: maximum days since the last access of an entry
+    """
+    bytes_limit = int(max_mb * 1024 ** 2) if max_mb is not None else None
+    age_limit = (
+        datetime.timedelta(days=max_age_days) if max_age_days is not None else None
+    )
+    evicted = prune_cache_items(
+        get_cache_items(cache_dir, function), bytes_limit, age_limit
+    )
+
+    size = sum(item.size for item in evicted) / 1024 ** 2
+    print(f"Evicted {len(evicted)} entries ({size:.1f} MB)")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,9 +1,29 @@
 # coding=utf-8
+import hashlib
+import heapq
 import json
+import math
+import os
+import threading
 import time
 import subprocess
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import click
+import numpy as np
+
+from backend.integrations.history import DatabaseHistory, SQLiteHistory
+from backend.integrations.svn_utils import get_log
+from backend.selection.problem_data import (
+    filter_changelist,
+    get_changed_files,
+    get_changed_indexes,
+    get_historical_metric_map,
+    load_activity_data,
+    normalize_iterative_test_name,
+)
 
 
 @click.group()
@@ -13,45 +33,447 @@ def cli():
 
 @cli.command("run")
 @click.argument("config_file", type=click.Path(exists=True, readable=True))
-def run_profiler_for_config(config_file):
+@click.option(
+    "--workers",
+    "-w",
+    default=1,
+    type=click.INT,
+    help="Number of OpenCover processes running at once",
+)
+@click.option(
+    "--retries", default=0, type=click.INT, help="Number of retries for failed runs"
+)
+@click.option(
+    "--opencover-exec",
+    help="Command to run instead of the configured OpenCover executable (e.g. a stand-in for testing)",
+)
+@click.option(
+    "--force", is_flag=True, help="Profile all runlists, even if their reports are fresh"
+)
+def run_profiler_for_config(config_file, workers, retries, opencover_exec, force):
     """
     Run OpenCover profiler for a given configuration file
 
+    Runlists are scheduled longest-first, using the run times in the profiler log of previous runs
+    (runlists without previous runs are scheduled first).
+    Runlists with a fresh report in the profiler manifest are skipped (see ProfilerManifest).
+
     :param config_file: path to the configuration file
+    :param workers: number of OpenCover processes running at once
+    :param retries: number of retries for each failed runlist
+    :param opencover_exec: command to run instead of the configured OpenCover executable
+    :param force: profile all runlists, ignoring the profiler manifest
     """
     # Load config file
     with open(config_file, mode="r") as demo_file:
         config = json.load(demo_file)
         test_lists = config["runlists"]
+    if opencover_exec is not None:
+        config["opencover_exec"] = opencover_exec
+
+    manifest = ProfilerManifest(config)
+    if not force:
+        fresh = [testlist for testlist in test_lists if manifest.is_fresh(testlist)]
+        for testlist in fresh:
+            print(f"Skipping {testlist}: report is fresh")
+        test_lists = [testlist for testlist in test_lists if testlist not in fresh]
+
+    log_path = f"{config['branch']}_log_profiler.txt"
+    run_times = get_runlists_run_times(log_path)
+    test_lists = sorted(
+        test_lists,
+        key=lambda testlist: -run_times.get(get_testlist_id(config, testlist), math.inf),
+    )
+
+    with open(log_path, mode="a") as log_file:
+        log = ProfilerLog(log_file)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                partial(
+                    run_coverage_profiler,
+                    config,
+                    log=log,
+                    retries=retries,
+                    manifest=manifest,
+                ),
+                test_lists,
+            )
+            failed = [testlist for testlist, ok in zip(test_lists, results) if not ok]
+
+        if failed:
+            log.write(f"Failed runlists: {failed}")
+
+
+@cli.command("finalized")
+@click.argument("config_file", type=click.Path(exists=True, readable=True))
+def list_finalized_reports(config_file):
+    """
+    Print the paths of the fresh reports in the profiler manifest, e.g. to start parsing them
+    with parse_xml.py update while other runlists are still being profiled.
+
+    :param config_file: path to the configuration file
+    """
+    with open(config_file, mode="r") as demo_file:
+        config = json.load(demo_file)
+
+    manifest = ProfilerManifest(config)
+    for testlist in config["runlists"]:
+        if manifest.is_fresh(testlist):
+            print(get_report_path(config, get_testlist_id(config, testlist)))
+
+
+@cli.command("shard")
+@click.argument("config_file", type=click.Path(exists=True, readable=True))
+@click.argument("all_tests", type=click.Path(exists=True, readable=True))
+@click.argument("shards", type=click.IntRange(min=1))
+@click.option("--from-dt", required=True, help="Start date of the execution times history")
+@click.option("--to-dt", required=True, help="End date of the execution times history")
+@click.option(
+    "--history",
+    "history_store",
+    type=click.Path(exists=True, readable=True),
+    help="Use a local SQLite history store instead of the database",
+)
+def shard_runlists(config_file, all_tests, shards, from_dt, to_dt, history_store):
+    """
+    Split a list of tests into runlists balanced by historical execution time and update the configuration file
+
+    Tests are assigned with the LPT (longest processing time first) rule: each test, from the longest to
+    the shortest, is added to the runlist with the lowest total time.
+
+    :param config_file: path to the configuration file
+    :param all_tests: path to file with the list of all tests (one per line)
+    :param shards: number of runlists to create
+    :param from_dt: start date of the execution times history
+    :param to_dt: end date of the execution times history
+    :param history_store: path to a local SQLite history store
+    """
+    with open(config_file, mode="r") as demo_file:
+        config = json.load(demo_file)
+    with open(all_tests, mode="r") as tests_file:
+        tests = [line.strip() for line in tests_file if line.strip()]
+
+    history = SQLiteHistory(history_store) if history_store else DatabaseHistory()
+    durations = get_tests_durations(tests, history, from_dt, to_dt)
+
+    config["runlists"] = write_balanced_runlists(config, durations, shards, "shard")
+    with open(config_file, mode="w") as demo_file:
+        json.dump(config, demo_file, indent=4)
+
+
+@cli.command("changed")
+@click.argument("config_file", type=click.Path(exists=True, readable=True))
+@click.argument("demo_config", type=click.Path(exists=True, readable=True))
+@click.argument("activity_matrix", type=click.Path(exists=True, readable=True))
+@click.argument("shards", type=click.IntRange(min=1))
+@click.option(
+    "--output",
+    "-o",
+    "output_config",
+    required=True,
+    type=click.Path(),
+    help="Path of the configuration file written with the new runlists",
+)
+@click.option("--from-dt", help="Start date of the svn log (default: demo config)")
+@click.option("--to-dt", help="End date of the svn log (default: demo config)")
+@click.option(
+    "--history",
+    "history_store",
+    type=click.Path(exists=True, readable=True),
+    help="Use a local SQLite history store instead of the database",
+)
+def changed_runlists(
+    config_file,
+    demo_config,
+    activity_matrix,
+    shards,
+    output_config,
+    from_dt,
+    to_dt,
+    history_store,
+):
+    """
+    Create runlists with only the tests covering the files changed in a svn log date range,
+    to re-profile their coverage (e.g. before updating the activity matrix with parse_xml.py update).
+
+    Changed files are mapped to the activity matrix methods as in the test selection pipeline.
+    The runlists are balanced by historical execution time, as in the shard command.
+
+    :param config_file: path to the configuration file
+    :param demo_config: path to the demo configuration file (branch, svn log range and ignored changes)
+    :param activity_matrix: path of the activity matrix JSON file
+    :param shards: number of runlists to create
+    :param output_config: path of the configuration file written with the new runlists
+    :param from_dt: start date of the svn log
+    :param to_dt: end date of the svn log
+    :param history_store: path to a local SQLite history store
+    """
+    with open(config_file, mode="r") as oc_file:
+        config = json.load(oc_file)
+    with open(demo_config, mode="r") as demo_file:
+        demo = json.load(demo_file)
+    from_dt = from_dt or demo["from_dt"]
+    to_dt = to_dt or demo["to_dt"]
+
+    # Collect the changed files of the log
+    changed_files = set()
+    for log_e in get_log(demo["branch_path"], from_dt, to_dt):
+        changelist = filter_changelist(log_e.changelist, demo["ignore_changes"])
+        changed_files.update(f for _, f in get_changed_files(changelist, demo["branch"]))
+    print(f"Changed files: {len(changed_files)}")
+
+    # Find the tests covering the methods of the changed files
+    matrix, tests_index, methods_map = load_activity_data(activity_matrix)
+    methods_index = np.array(list(methods_map.values()))
+    changed_indexes = get_changed_indexes(
+        methods_map, methods_index, sorted(changed_files)
+    )
+    tests = list(tests_index[matrix[:, changed_indexes].any(axis=1)])
+    print(f"Changed methods: {len(changed_indexes)} -> tests to profile: {len(tests)}")
+    if not tests:
+        return
+
+    history = SQLiteHistory(history_store) if history_store else DatabaseHistory()
+    durations = get_tests_durations(tests, history, from_dt, to_dt)
+
+    config["runlists"] = write_balanced_runlists(config, durations, shards, "changed")
+    with open(output_config, mode="w") as oc_file:
+        json.dump(config, oc_file, indent=4)
+
+
+def get_tests_durations(tests, history, from_dt, to_dt):
+    """
+    Get the historical execution time of a list of tests.
+
+    Tests without execution times history are assumed to take the average execution time.
+
+    :param tests: list of test names
+    :param history: history provider
+    :param from_dt: start date of the execution times history
+    :param to_dt: end date of the execution times history
+    :return: map of test names to durations
+    """
+    execution_times = get_historical_metric_map(
+        history.get_test_execution_times(from_dt, to_dt)
+    )
+    durations = {
+        test: execution_times.get(normalize_iterative_test_name(test)) for test in tests
+    }
+    known = [duration for duration in durations.values() if duration is not None]
+    default_duration = sum(known) / len(known) if known else 1
+    return {
+        test: duration if duration is not None else default_duration
+        for test, duration in durations.items()
+    }
 
-    with open(f"{config['branch']}_log_profiler.txt", mode="a") as log_file:
-        for testlist in test_lists:
-            run_coverage_profiler(config, testlist, log_file)
 
+def write_balanced_runlists(config, durations, shards, prefix):
+    """
+    Write runlists balanced by duration to the runlists directory ({prefix}_{i}.in files).
 
-def run_coverage_profiler(config, testlist, log_file):
+    :param config: configuration
+    :param durations: map of test names to durations
+    :param shards: number of runlists
+    :param prefix: prefix of the runlists file names
+    :return: list of paths of the runlists
+    """
+    runlists = []
+    for i, (total, shard_tests) in enumerate(get_balanced_shards(durations, shards)):
+        runlist = f"{config['runlists_path']}{prefix}_{i}.in"
+        with open(runlist, mode="w") as runlist_file:
+            runlist_file.writelines(f"{test}\n" for test in shard_tests)
+        print(f"{runlist}: {len(shard_tests)} tests, {total:.1f} total time")
+        runlists.append(runlist)
+    return runlists
+
+
+def get_balanced_shards(durations, shards):
+    """
+    Split tests into shards with balanced total durations, using the LPT rule.
+
+    :param durations: map of test names to durations
+    :param shards: number of shards
+    :return: list of (total duration, list of tests) for each shard
+    """
+    heap = [(0, i) for i in range(shards)]
+    shards_tests = [[] for _ in range(shards)]
+    for test in sorted(durations, key=lambda t: durations[t], reverse=True):
+        total, i = heapq.heappop(heap)
+        shards_tests[i].append(test)
+        heapq.heappush(heap, (total + durations[test], i))
+
+    totals = {i: total for total, i in heap}
+    return [(totals[i], shards_tests[i]) for i in range(shards)]
+
+
+class ProfilerLog:
+    """
+    Profiler log file shared by the runs executed in parallel.
+    """
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.lock = threading.Lock()
+
+    def write(self, message):
+        with self.lock:
+            print(message)
+            self.log_file.write(message + "\n")
+            self.log_file.flush()
+
+
+class ProfilerManifest:
+    """
+    Manifest of the profiled runlists, stored as profiler_manifest.json in the reports directory.
+
+    Each runlist entry records the runlist content hash, the last modification time of the binaries/pdbs
+    in searchdirs_path and the status of its report (running, failed or done).
+    A report is fresh if it is done and neither the runlist nor the binaries changed since it was profiled.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.path = f"{config['reports_path']}profiler_manifest.json"
+        self.lock = threading.Lock()
+        self.binaries_mtime = get_binaries_mtime(config["searchdirs_path"])
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, mode="r") as manifest_file:
+                self.entries = json.load(manifest_file)
+
+    def get_entry(self, testlist):
+        return {
+            "runlist_hash": get_file_hash(testlist),
+            "binaries_mtime": self.binaries_mtime,
+        }
+
+    def is_fresh(self, testlist):
+        """
+        Check if the report of a runlist is fresh.
+
+        :param testlist: path to file with list of tests to run
+        :return: True if the report is done and up to date
+        """
+        testlist_id = get_testlist_id(self.config, testlist)
+        entry = self.entries.get(testlist_id)
+        return (
+            entry is not None
+            and entry["status"] == "done"
+            and entry["runlist_hash"] == get_file_hash(testlist)
+            and entry["binaries_mtime"] == self.binaries_mtime
+            and os.path.exists(get_report_path(self.config, testlist_id))
+        )
+
+    def set_status(self, testlist, status):
+        """
+        Update the status of a runlist report, writing the manifest file atomically.
+
+        The runlist hash and binaries timestamp are recorded when the run starts (running status).
+
+        :param testlist: path to file with list of tests to run
+        :param status: report status (running, failed or done)
+        """
+        testlist_id = get_testlist_id(self.config, testlist)
+        with self.lock:
+            entry = self.entries.get(testlist_id)
+            if status == "running" or entry is None:
+                entry = self.get_entry(testlist)
+            self.entries[testlist_id] = dict(entry, status=status)
+            with open(self.path + ".tmp", mode="w") as manifest_file:
+                json.dump(self.entries, manifest_file, indent=4)
+            os.replace(self.path + ".tmp", self.path)
+
+
+def get_binaries_mtime(searchdirs_path):
+    """
+    Get the last modification time of the binaries and pdb files in a directory.
+
+    :param searchdirs_path: path to the application pdb directories
+    :return: last modification timestamp (0 if there are no files)
+    """
+    mtimes = [0]
+    for dirpath, _, filenames in os.walk(searchdirs_path):
+        for filename in filenames:
+            if filename.lower().endswith((".dll", ".exe", ".pdb")):
+                mtimes.append(os.path.getmtime(os.path.join(dirpath, filename)))
+    return max(mtimes)
+
+
+def get_file_hash(path):
+    with open(path, mode="rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def get_runlists_run_times(log_path):
+    """
+    Get the run time of each runlist from the profiler log of previous runs (the last run of each runlist).
+
+    :param log_path: path to the profiler log file
+    :return: map of runlist ids to run times in minutes
+    """
+    run_times = {}
+    if not os.path.exists(log_path):
+        return run_times
+
+    with open(log_path, mode="r") as log_file:
+        for line in log_file:
+            re_search = re.match(r"Run for (.*): (\S+) minutes", line)
+            if re_search:
+                run_times[re_search.group(1)] = float(re_search.group(2))
+    return run_times
+
+
+def run_coverage_profiler(config, testlist, log, retries=0, manifest=None):
     """
     Run OpenCover profiler for a given list of tests and configuration file
 
+    The output of OpenCover is written to a log file next to the runlist report.
+
     :param config: path to configuration file
     :param testlist: path to file with list of tests to run
-    :param log_file: path to logging file
+    :param log: profiler log
+    :param retries: number of retries if OpenCover fails
+    :param manifest: profiler manifest where the report status is recorded
+    :return: True if the run was successful
     """
-    def write_log(message):
-        print(message)
-        log_file.write(message + "\n")
-        log_file.flush()
-
-    write_log(testlist)
+    log.write(testlist)
     command, testlist_id = get_opencover_args(config, testlist)
-    write_log(f"Command: {command} --> Output: {testlist_id}")
+    log.write(f"Command: {command} --> Output: {testlist_id}")
+    if manifest is not None:
+        manifest.set_status(testlist, "running")
 
-    # Run and profile tests with OpenCover
-    start = time.perf_counter()
-    subprocess.call(command)
-    end = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        # Run and profile tests with OpenCover
+        start = time.perf_counter()
+        try:
+            with open(
+                f"{config['reports_path']}refactor_{testlist_id}.log", "a"
+            ) as output:
+                return_code = subprocess.call(
+                    command, stdout=output, stderr=subprocess.STDOUT
+                )
+        except OSError as e:
+            # e.g. missing or misconfigured OpenCover executable
+            log.write(
+                f"Failed run for {testlist_id} (attempt {attempt}): {type(e).__name__}: {e}"
+            )
+            continue
+        end = time.perf_counter()
 
-    write_log(f"Run for {testlist_id}: {(end - start) / 60} minutes")
+        if return_code == 0:
+            log.write(f"Run for {testlist_id}: {(end - start) / 60} minutes")
+            if manifest is not None:
+                manifest.set_status(testlist, "done")
+            log.write(f"Report finalized: {get_report_path(config, testlist_id)}")
+            return True
+        log.write(
+            f"Failed run for {testlist_id} (attempt {attempt}, exit code {return_code}): "
+            f"{(end - start) / 60} minutes"
+        )
+
+    if manifest is not None:
+        manifest.set_status(testlist, "failed")
+    return False
 
 
 def get_opencover_args(config, testlist):
@@ -75,14 +497,22 @@ def get_opencover_args(config, testlist):
         f" -searchdirs: {config['searchdirs_path']} ",
         " -register:user ",
     ]
-    testlist_id = re.search(re.escape(config["runlists_path"]) + r"(.*).in", testlist).group(1)
+    testlist_id = get_testlist_id(config, testlist)
 
     # Build OpenCover command with arguments
     command = [config["opencover_exec"]]
     command.extend(args)
-    command.append(f"-output:{config['reports_path']}refactor_{testlist_id}.xml")
+    command.append(f"-output:{get_report_path(config, testlist_id)}")
     return command, testlist_id
 
 
+def get_testlist_id(config, testlist):
+    return re.search(re.escape(config["runlists_path"]) + r"(.*).in", testlist).group(1)
+
+
+def get_report_path(config, testlist_id):
+    return f"{config['reports_path']}refactor_{testlist_id}.xml"
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,42 @@
+# coding=utf-8
+import json
+
+import click
+
+from backend.integrations.history import DatabaseHistory, SQLiteHistory, mirror_history
+from backend.integrations.svn_utils import get_log
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("import")
+@click.argument("history_store", type=click.Path())
+@click.argument("demo_config", type=click.Path(exists=True, readable=True))
+def import_history(history_store, demo_config):
+    """
+    Mirror the database history data required by a demo configuration into a local SQLite store.
+
+    :param history_store: path to the SQLite history store (created if needed)
+    :param demo_config: path to the demo configuration file
+    """
+    with open(demo_config, mode="r") as demo_file:
+        config = json.load(demo_file)
+
+    log = get_log(config["branch_path"], config["from_dt"], config["to_dt"])
+
+    mirror_history(
+        DatabaseHistory(),
+        SQLiteHistory(history_store),
+        config["fails_start_dt"],
+        config["from_dt"],
+        config["to_dt"],
+        [log_e.revision for log_e in log],
+    )
+    print("History import done")
+
+
+if __name__ == "__main__":
+    cli()
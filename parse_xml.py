@@ -1,65 +1,333 @@
 # coding=utf-8
+import heapq
 import itertools
+import json
 import os
+import tempfile
+from contextlib import ExitStack
 from functools import partial
 from multiprocessing import Pool
 
 import click
-import numpy as np
 
 from backend.opencover import parser
 
+# Max number of shard files opened at once by each merge step
+MAX_MERGE_FILES = 64
 
-@click.command("multiple")
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("multiple")
 @click.argument("reports_path")
 @click.argument("output_name")
 @click.argument("branch_name")
-def process_multiple_xml_reports(reports_path, output_name, branch_name):
+@click.option(
+    "--workers", "-w", default=2, type=click.INT, help="Number of parsing processes"
+)
+def process_multiple_xml_reports(reports_path, output_name, branch_name, workers):
     """
     Parse OpenCover's XML coverage reports into an activity matrix and tests/methods name maps
     Assumes that the reports_path is a directory containing multiple coverage reports.
 
+    Each report is parsed into a shard file on disk, and the shards are merged in a streaming k-way merge.
+    Methods/tests ids are derived from their names, so the output does not depend on the reports order.
+
     :param reports_path: path to directory containing the coverage reports
     :param output_name: name of the output files generated for the activity matrix and maps
     :param branch_name: name of the branch used for matching with files in the repository
+    :param workers: number of processes used to parse the reports
     """
     # Get coverage reports files from the directory
-    report_files = list(
-        map(
-            lambda report: os.path.abspath(os.path.join(reports_path, report)),
-            os.listdir(reports_path),
+    report_files = get_report_files([reports_path])
+
+    with tempfile.TemporaryDirectory() as shards_dir:
+        shards = parse_reports(report_files, branch_name, workers, shards_dir)
+        methods_map, tests_map, methods_lines = join_shards_maps(shards, report_files)
+
+        # Merge id-activity shards
+        entries_files = [shards[report]["entries"] for report in report_files]
+        merged_file = merge_shards(entries_files, shards_dir)
+
+        # Export merged results
+        with open(merged_file) as merged:
+            export_activity_matrix(
+                output_name,
+                methods_map,
+                tests_map,
+                map(json.loads, merged),
+                methods_lines,
+            )
+
+    # Record the content hash and tests of each report, to skip unchanged reports on updates
+    manifest = {
+        get_report_key(report): get_manifest_entry(shards[report])
+        for report in report_files
+    }
+    parser.export_manifest(output_name, manifest)
+
+
+@cli.command("update")
+@click.argument("output_name")
+@click.argument("branch_name")
+@click.argument("reports", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--workers", "-w", default=2, type=click.INT, help="Number of parsing processes"
+)
+def update_activity_matrix(output_name, branch_name, reports, workers):
+    """
+    Update an existing activity matrix and tests/methods name maps with new or changed coverage reports.
+
+    Reports with the same content hash as recorded in the matrix manifest are skipped.
+    The rows of the tests of the updated reports are replaced by their new coverage, and new tests/methods
+    are appended. Each test is expected to be covered by a single report (i.e. a single runlist).
+
+    :param output_name: name of the existing activity matrix and maps JSON files
+    :param branch_name: name of the branch used for matching with files in the repository
+    :param reports: paths to new/changed coverage reports (or directories containing them)
+    :param workers: number of processes used to parse the reports
+    """
+    manifest = parser.import_manifest(output_name)
+    hashes = {
+        report: parser.get_file_hash(report) for report in get_report_files(reports)
+    }
+    report_files = [
+        report
+        for report, report_hash in hashes.items()
+        if manifest.get(get_report_key(report), {}).get("hash") != report_hash
+    ]
+    if not report_files:
+        print("No new or changed reports")
+        return
+
+    print(f"Updating activity matrix with {len(report_files)} reports")
+    activity_matrix, methods_map, tests_map = parser.import_data_from_json(output_name)
+
+    with tempfile.TemporaryDirectory() as shards_dir:
+        shards = parse_reports(report_files, branch_name, workers, shards_dir, hashes)
+        new_methods_map, new_tests_map, new_methods_lines = join_shards_maps(
+            shards, report_files
         )
+
+        # Tests previously covered by the updated reports are replaced too
+        replaced_tests = set(new_tests_map)
+        for report in report_files:
+            old_entry = manifest.get(get_report_key(report), {})
+            replaced_tests.update(old_entry.get("tests", []))
+
+        # Merge id-activity shards into the existing matrix
+        entries_files = [shards[report]["entries"] for report in report_files]
+        merged_file = merge_shards(entries_files, shards_dir)
+        with open(merged_file) as merged:
+            activity_matrix, methods_map, tests_map = parser.update_activity_matrix(
+                activity_matrix,
+                methods_map,
+                tests_map,
+                map(json.loads, merged),
+                new_methods_map,
+                new_tests_map,
+                replaced_tests,
+            )
+
+    print(f"Exporting processed data to json files")
+    parser.export_data_to_json(output_name, activity_matrix, methods_map, tests_map)
+    methods_lines = parser.import_methods_lines(output_name)
+    methods_lines.update(new_methods_lines)
+    parser.export_methods_lines(
+        output_name, {k: methods_lines[k] for k in methods_map if k in methods_lines}
     )
+    for report in report_files:
+        manifest[get_report_key(report)] = get_manifest_entry(shards[report])
+    parser.export_manifest(output_name, manifest)
+
+    print("Report processing done")
+
+
+def get_report_files(paths):
+    """
+    Get the coverage report files in a list of paths to report files or directories.
+
+    :param paths: list of paths to report files or directories
+    :return: list of absolute paths to the report files (raises a ClickException if there are none)
+    """
+    report_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            report_files.extend(
+                os.path.abspath(os.path.join(path, report))
+                for report in os.listdir(path)
+            )
+        else:
+            report_files.append(os.path.abspath(path))
+
+    if not report_files:
+        raise click.ClickException(f"No coverage reports found in {', '.join(paths)}")
+    return report_files
+
 
-    # Collect id-activity matrices for each report
-    with Pool(processes=2) as pool:
-        result = pool.map(
-            partial(get_id_activity_matrix, branch=branch_name), report_files
+def get_report_key(report):
+    """
+    Get the key of a coverage report in the manifest: its normalized path relative to the current directory.
+
+    :param report: path to the coverage report
+    :return: manifest key of the report
+    """
+    path = os.path.abspath(report)
+    try:
+        path = os.path.relpath(path)
+    except ValueError:
+        # Reports in another drive keep their absolute path
+        pass
+    return os.path.normcase(path).replace(os.sep, "/")
+
+
+def parse_reports(report_files, branch, workers, shards_dir, hashes=None):
+    """
+    Parse XML coverage reports into shard files, scheduling the largest reports first.
+
+    :param report_files: list of paths to the coverage reports
+    :param branch: name of the branch used for matching with files in the repository
+    :param workers: number of parsing processes
+    :param shards_dir: directory where the shard files are written
+    :param hashes: map of report paths to their already computed content hash
+    :return: map of report paths to shard details (see write_report_shard)
+    """
+    hashes = hashes if hashes is not None else {}
+    schedule = [
+        (report, hashes.get(report))
+        for report in sorted(report_files, key=os.path.getsize, reverse=True)
+    ]
+    with Pool(processes=workers) as pool:
+        return dict(
+            pool.imap_unordered(
+                partial(write_report_shard, branch=branch, shards_dir=shards_dir),
+                schedule,
+                chunksize=1,
+            )
         )
 
-    array_result = np.array(result)
-    id_act_matrices = array_result[:, 0]
-    methods_map, tests_map = array_result[0, 1], array_result[0, 2]
 
-    # Merge id-activity matrices
-    x = {
-        k: [d.get(k, []) for d in id_act_matrices]
-        for k in {k for d in id_act_matrices for k in d}
+def join_shards_maps(shards, report_files):
+    """
+    Join the methods/tests maps of the shards of a list of reports, sorted by id.
+
+    :param shards: map of report paths to shard details
+    :param report_files: list of paths to the coverage reports
+    :return: methods map, tests map and methods lines map
+    """
+    methods_map, tests_map, methods_lines = {}, {}, {}
+    for report in report_files:
+        with open(shards[report]["maps"]) as maps_file:
+            report_methods_map, report_tests_map, report_lines = json.load(maps_file)
+        methods_map.update(report_methods_map)
+        tests_map.update(report_tests_map)
+        methods_lines.update(report_lines)
+    return (
+        dict(sorted(methods_map.items())),
+        dict(sorted(tests_map.items())),
+        methods_lines,
+    )
+
+
+def get_manifest_entry(shard):
+    return {"hash": shard["hash"], "tests": shard["tests"]}
+
+
+def write_report_shard(report, branch, shards_dir):
+    """
+    Parse a XML coverage report into shard files: a JSON file with the methods/tests/lines maps and
+    a JSON-lines file with the id-activity entries sorted by method id.
+
+    :param report: path to the XML coverage report and its content hash (None to compute it)
+    :param branch: name of the branch used for matching with files in the repository
+    :param shards_dir: directory where the shard files are written
+    :return: report path and shard details (files paths, report content hash and tests ids)
+    """
+    xml_report, report_hash = report
+    if report_hash is None:
+        report_hash = parser.get_file_hash(xml_report)
+    id_act_matrix, methods_map, tests_map, methods_lines = get_id_activity_matrix(
+        xml_report, branch
+    )
+
+    maps_file = new_shard_file(shards_dir, ".json")
+    with open(maps_file, "w") as outfile:
+        json.dump([methods_map, tests_map, methods_lines], outfile)
+
+    entries = sorted(id_act_matrix.items())
+    entries_file = new_shard_file(shards_dir, ".jsonl")
+    write_entries(entries_file, entries)
+
+    shard = {
+        "maps": maps_file,
+        "entries": entries_file,
+        "hash": report_hash,
+        "tests": sorted(tests_map),
     }
-    merged_id_act_matrices = {k: list(itertools.chain(*x[k])) for k in x}
+    return xml_report, shard
+
+
+def new_shard_file(shards_dir, suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=shards_dir)
+    os.close(fd)
+    return path
+
 
-    # Export merged results
-    export_activity_matrix(output_name, methods_map, tests_map, merged_id_act_matrices)
+def write_entries(path, entries):
+    with open(path, "w") as outfile:
+        for entry in entries:
+            outfile.write(json.dumps(entry) + "\n")
 
 
-def export_activity_matrix(output_name, methods_map, tests_map, activity_matrix):
+def merge_shards(entries_files, shards_dir):
     """
-    Build+export activity matrix and tests/methods map to JSON files.
+    Merge sorted id-activity shards into a single sorted shard, concatenating the tests of each method.
+
+    Shards are merged in groups of MAX_MERGE_FILES, so the number of open files is bounded.
+
+    :param entries_files: list of JSON-lines files with id-activity entries sorted by method id
+    :param shards_dir: directory where the merged shard files are written
+    :return: path of the merged shard file
+    """
+    while len(entries_files) > 1:
+        merged_files = []
+        for start in range(0, len(entries_files), MAX_MERGE_FILES):
+            group = entries_files[start : start + MAX_MERGE_FILES]
+            merged_file = new_shard_file(shards_dir, ".jsonl")
+            with ExitStack() as stack:
+                readers = [
+                    map(json.loads, stack.enter_context(open(path))) for path in group
+                ]
+                merged = heapq.merge(*readers, key=lambda entry: entry[0])
+                write_entries(
+                    merged_file,
+                    (
+                        [method, list(itertools.chain(*(e[1] for e in method_entries)))]
+                        for method, method_entries in itertools.groupby(
+                            merged, key=lambda entry: entry[0]
+                        )
+                    ),
+                )
+            merged_files.append(merged_file)
+        entries_files = merged_files
+
+    return entries_files[0]
+
+
+def export_activity_matrix(
+    output_name, methods_map, tests_map, activity_matrix, methods_lines=None
+):
+    """
+    Build+export activity matrix, tests/methods map and methods lines to JSON files.
 
     :param output_name: name identifier for the JSON output files
-    :param activity_matrix: id-activity matrix
+    :param activity_matrix: iterable of id-activity entries (method id, tests uids)
     :param methods_map: methods map
     :param tests_map: tests map
+    :param methods_lines: map of method ids to first/last source lines
     """
     # Convert id-activity matrix to binary activity matrix
     print(f"Converting to the binary activity matrix")
@@ -74,32 +342,24 @@ def export_activity_matrix(output_name, methods_map, tests_map, activity_matrix)
     # Export results to json
     print(f"Exporting processed data to json files")
     parser.export_data_to_json(output_name, filter_act_matrix, methods_map, tests_map)
+    if methods_lines is not None:
+        parser.export_methods_lines(
+            output_name,
+            {k: methods_lines[k] for k in methods_map if k in methods_lines},
+        )
 
     print("Report processing done")
 
 
 def get_id_activity_matrix(xml_report, branch):
-    # Get files map
-    print(f"Getting file map to handle c# namespace issues")
-    files_map = parser.get_files_map_from_report(xml_report, branch)
-
-    # Split xml report based on module type (test vs code)
-    print(f"Loading xml report {xml_report}")
-    test_modules, code_modules = parser.get_modules_from_report(xml_report)
-
-    # Fill uid maps with tests names and methods names
-    print(f"Mapping tests and methods uids")
-    tests_map = parser.build_tests_map(test_modules)
-    methods_map = parser.build_methods_map(code_modules)
-
-    # Build activity matrix based on ids
-    print(f"Building the id-activity matrix")
-    id_act_matrix = parser.build_id_activity_matrix(
-        code_modules, methods_map, files_map
+    # Build files/tests/methods maps and the id-activity matrix in a single pass
+    print(f"Processing xml report {xml_report}")
+    _, tests_map, methods_map, id_act_matrix, methods_lines = parser.process_report(
+        xml_report, branch
     )
     print(f" {xml_report} -- {len(id_act_matrix)}")
-    return id_act_matrix, methods_map, tests_map
+    return id_act_matrix, methods_map, tests_map, methods_lines
 
 
 if __name__ == "__main__":
-    process_multiple_xml_reports()
+    cli()
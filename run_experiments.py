@@ -0,0 +1,280 @@
+# coding=utf-8
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+import traceback
+
+import click
+import numpy as np
+
+from backend.evaluation.results_log import ResultsLog
+from backend.integrations import svn_utils
+from backend.integrations.cache import print_cache_stats
+from backend.selection.problem_data import ProblemData
+from generate_tests import COVERAGE_MAP, HISTORY_MAP
+from testsel_pipeline import (
+    SEED,
+    get_history_provider,
+    run_demo_batch,
+    run_random_batch,
+    set_output_mode,
+)
+
+# Short names of the objectives in the output names (as in generate_tests.py)
+OBJECTIVES_NAMES = {**COVERAGE_MAP, **HISTORY_MAP}
+
+# Datasets loaded by this process: name -> (problem data, svn log, config, all tests)
+DATASETS = {}
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("run")
+@click.option(
+    "--workers",
+    "-w",
+    type=click.INT,
+    help="Number of runs executed in parallel (overrides the workers of the grid)",
+)
+@click.option("--force", is_flag=True, help="Rerun the runs with an existing output")
+@click.option("--dry-run", is_flag=True, help="Only print the runs of the grid")
+@click.argument("grid_file", type=click.Path(exists=True, readable=True))
+def run_experiments(grid_file, workers, force, dry_run):
+    """
+        Run the experiments of a declarative grid, loading the data of each dataset only once.
+
+        Each run writes the same outputs as the equivalent testsel_pipeline.py command:
+        OUTPUT.pickle with the results summary and OUTPUT.out with the printed results.
+    """
+    with open(grid_file, mode="r") as grid_json:
+        grid = json.load(grid_json)
+
+    runs = get_grid_runs(grid)
+    for run in runs:
+        run["restart"] = force
+    if not force:
+        runs = [run for run in runs if not os.path.exists(f"{run['output']}.pickle")]
+    print(f"{len(runs)} runs to execute")
+    if dry_run or not runs:
+        for run in runs:
+            print(f"{run['type']}: {run['output']}")
+        return
+
+    # Load the data of each dataset used by the runs before starting the workers,
+    # so forked workers share it (copy-on-write) instead of loading it again
+    context = get_context()
+    datasets = {run["dataset"] for run in runs}
+    if context.get_start_method() == "fork":
+        for name in sorted(datasets):
+            load_dataset(name, grid["datasets"][name])
+
+    workers = workers if workers is not None else grid.get("workers", 3)
+    with context.Pool(
+        processes=workers, initializer=init_worker, initargs=(grid, datasets)
+    ) as pool:
+        failed = []
+        for output, elapsed, error in pool.imap_unordered(execute_run, runs):
+            if error is None:
+                print(f"Finished {output} ({elapsed:.0f} seconds)")
+            else:
+                print(f"Failed {output} ({elapsed:.0f} seconds): {error}")
+                failed.append(output)
+
+    print_cache_stats()
+    if failed:
+        raise click.ClickException(f"{len(failed)} runs failed: {failed}")
+
+
+def get_grid_runs(grid: dict) -> list:
+    """
+    Expand the experiments of a grid to a list of runs.
+
+    Experiments of type "pipeline" run testsel_pipeline.py demo for each combination of objectives
+    and swarm size. Experiments of type "random" run testsel_pipeline.py random for each probability
+    and repetition. The output of a run is a format string with the fields dataset, objectives,
+    swarm_size, p (percentage) and run.
+
+    :param grid: grid definition
+    :return: list of runs
+    """
+    runs = []
+    output_path = grid.get("output_path", "")
+    for experiment in grid["experiments"]:
+        datasets = experiment.get("datasets", list(grid["datasets"].keys()))
+        if experiment["type"] == "pipeline":
+            combos = itertools.product(
+                datasets, experiment["objectives"], experiment["swarm_sizes"]
+            )
+            for dataset, objectives, swarm_size in combos:
+                output = experiment["output"].format(
+                    dataset=dataset,
+                    objectives="".join(OBJECTIVES_NAMES.get(o, o) for o in objectives),
+                    swarm_size=swarm_size,
+                )
+                runs.append(
+                    {
+                        "type": "pipeline",
+                        "dataset": dataset,
+                        "objectives": objectives,
+                        "swarm_size": swarm_size,
+                        "output": os.path.join(output_path, output),
+                    }
+                )
+        elif experiment["type"] == "random":
+            combos = itertools.product(
+                datasets, experiment["p"], range(1, experiment.get("runs", 1) + 1)
+            )
+            for dataset, random_p, i in combos:
+                output = experiment["output"].format(
+                    dataset=dataset, p=str(int(random_p * 100)), run=i
+                )
+                runs.append(
+                    {
+                        "type": "random",
+                        "dataset": dataset,
+                        "random_p": random_p,
+                        "fixed": experiment.get("fixed", False),
+                        "filtered": experiment.get("filtered", False),
+                        "output": os.path.join(output_path, output),
+                    }
+                )
+        else:
+            raise click.BadParameter(f"unknown experiment type {experiment['type']}")
+    return runs
+
+
+def load_dataset(name: str, dataset: dict):
+    """
+    Load the problem data, svn log and tests of a dataset into this process.
+
+    :param name: name of the dataset
+    :param dataset: dataset definition (activity_matrix, config, all_tests and history paths)
+    """
+    print(f"Loading dataset {name}")
+    with open(dataset["config"], mode="r") as demo_file:
+        config = json.load(demo_file)
+
+    log = svn_utils.get_log(config["branch_path"], config["from_dt"], config["to_dt"])
+
+    data = ProblemData(
+        dataset["activity_matrix"],
+        config["branch"],
+        config["fails_start_dt"],
+        config["from_dt"],
+        config["to_dt"],
+        ignore_tests=config["ignore_tests"],
+        history=get_history_provider(dataset.get("history"), False),
+    )
+    data.history.get_testfails_for_revisions([log_e.revision for log_e in log])
+
+    tests = []
+    if dataset.get("all_tests") is not None:
+        with open(dataset["all_tests"], mode="r") as tests_file:
+            tests = [test.strip() for test in tests_file.readlines()]
+
+    DATASETS[name] = (data, log, config, tests)
+
+
+def get_context():
+    # Fork shares the loaded datasets with the workers; other platforms load them once per worker
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def init_worker(grid: dict, datasets: set):
+    """
+    Prepare a worker process: load the datasets missing in this process (i.e. not inherited with fork)
+    and drop the database/SQLite connections inherited from the parent, which can't be shared.
+
+    :param grid: grid definition
+    :param datasets: names of the datasets used by the runs
+    """
+    svn_utils._store = None
+    if "backend.integrations.database" in sys.modules:
+        sys.modules["backend.integrations.database"].pool.reset_after_fork()
+
+    for name in sorted(datasets):
+        if name not in DATASETS:
+            load_dataset(name, grid["datasets"][name])
+        elif grid["datasets"][name].get("history") is not None:
+            DATASETS[name][0].history = get_history_provider(
+                grid["datasets"][name]["history"], False
+            )
+
+
+def execute_run(run: dict):
+    """
+    Execute a run of the grid, writing its printed results to OUTPUT.out and its summary to OUTPUT.pickle.
+
+    A failing run doesn't stop the other runs: its error is returned and its traceback appended to OUTPUT.out.
+
+    :param run: run definition
+    :return: output of the run, elapsed seconds and error message (None if the run succeeded)
+    """
+    start = time.perf_counter()
+    try:
+        write_run_outputs(run)
+    except Exception as e:
+        try:
+            with open(f"{run['output']}.out", mode="a") as out_file:
+                traceback.print_exc(file=out_file)
+        except OSError:
+            pass
+        return run["output"], time.perf_counter() - start, f"{type(e).__name__}: {e}"
+    return run["output"], time.perf_counter() - start, None
+
+
+def write_run_outputs(run: dict):
+    """
+    Execute a run of the grid in this process (see execute_run).
+
+    :param run: run definition
+    """
+    data, log, config, tests = DATASETS[run["dataset"]]
+
+    # Reset the state left by the previous runs of this worker, as in a new process
+    data.reset()
+    data.new_files = {}
+    np.random.seed(SEED)
+    random.seed()
+    set_output_mode("text")
+
+    os.makedirs(os.path.dirname(run["output"]) or ".", exist_ok=True)
+    with open(f"{run['output']}.out", mode="w") as out_file:
+        with contextlib.redirect_stdout(out_file):
+            if run["type"] == "pipeline":
+                data.swarm_size = run["swarm_size"]
+                summary = run_demo_batch(
+                    data,
+                    log,
+                    config,
+                    run["objectives"],
+                    ResultsLog(f"{run['output']}.pickle.jsonl", run["restart"]),
+                )
+            else:
+                summary = run_random_batch(
+                    data,
+                    log,
+                    config,
+                    tests,
+                    run["random_p"],
+                    run["fixed"],
+                    run["filtered"],
+                )
+            summary.export_to_text()
+
+    with open(f"{run['output']}.pickle", mode="wb") as output:
+        summary.export_to_pickle(output)
+
+
+if __name__ == "__main__":
+    cli()
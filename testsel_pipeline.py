@@ -1,6 +1,8 @@
 # coding=utf-8
 import json
+import os
 import random
+import time
 
 import click
 import numpy as np
@@ -8,13 +10,35 @@ from jmetal.core.algorithm import Algorithm
 
 import backend.selection.objectives as metrics
 from backend.evaluation.execution_item import RevisionResults
+from backend.evaluation.results_log import ResultsLog, to_json_value
 from backend.evaluation.summary import ResultsSummary
-from backend.integrations.svn_utils import get_log, get_log_for_revision
-from backend.selection.problem_data import ProblemData
+from backend.integrations.cache import print_cache_stats
+from backend.integrations.history import (
+    DatabaseHistory,
+    IncrementalHistory,
+    SQLiteHistory,
+)
+from backend.integrations.svn_utils import (
+    get_changed_lines,
+    get_log,
+    get_log_for_revision,
+    prefetch_log,
+)
+from backend.selection.problem_data import ProblemData, get_activity_data_paths
+from backend.selection.result_cache import (
+    DEFAULT_MAX_MB,
+    ResultCache,
+    get_run_key,
+    get_run_seed,
+)
+from backend.selection.server import SelectionServer
 from backend.selection.test_selection import TestSelection, my_binary_mopso
+from backend.selection.timing import StageTimer
+
+SEED = 1234
+np.random.seed(SEED)
 
-np.random.seed(1234)
-np.set_printoptions(threshold=np.inf)
+OUTPUT_MODES = ["text", "json", "quiet"]
 
 OBJECTIVES_MAP = {
     "ddu": metrics.calculate_ddu,
@@ -40,13 +64,62 @@ def cli():
     multiple=True,
 )
 @click.option("--masked", is_flag=True)
+@click.option(
+    "--output",
+    default="text",
+    show_default=True,
+    type=click.Choice(OUTPUT_MODES),
+    help="Results of each revision as text, as one compact JSON line, or not at all (quiet)",
+)
+@click.option(
+    "--history",
+    "history_store",
+    type=click.Path(dir_okay=False),
+    help="Use a local SQLite history store instead of the database (created by --refresh-history if missing)",
+)
+@click.option(
+    "--refresh-history",
+    is_flag=True,
+    help="Fetch the days/revisions missing from the history store from the database",
+)
+@click.option(
+    "--line-level",
+    is_flag=True,
+    help="Only map the changed methods of each file, using svn diff and the methods lines",
+)
+@click.option(
+    "--result-cache",
+    "result_cache_dir",
+    type=click.Path(file_okay=False),
+    help="Reuse the solutions found for the same changed methods and objectives, stored in this directory",
+)
+@click.option(
+    "--result-cache-mb",
+    default=DEFAULT_MAX_MB,
+    show_default=True,
+    type=click.FLOAT,
+    help="Maximum size of the result cache in MB (least recently used entries are evicted)",
+)
 @click.argument("swarm_size", type=click.INT)
 @click.argument("activity_matrix", type=click.Path(exists=True, readable=True))
 @click.argument("demo_config", type=click.Path(exists=True, readable=True))
-def run_optimization(objectives, masked, activity_matrix, demo_config, swarm_size):
+def run_optimization(
+    objectives,
+    masked,
+    output,
+    history_store,
+    refresh_history,
+    line_level,
+    result_cache_dir,
+    result_cache_mb,
+    activity_matrix,
+    demo_config,
+    swarm_size,
+):
     """
         User input-based execution of the pipeline
     """
+    set_output_mode(output)
     with open(demo_config, mode="r") as demo_file:
         config = json.load(demo_file)
     # Build problem data
@@ -57,9 +130,14 @@ def run_optimization(objectives, masked, activity_matrix, demo_config, swarm_siz
         config["from_dt"],
         config["to_dt"],
         ignore_tests=config["ignore_tests"],
+        history=get_history_provider(history_store, refresh_history),
     )
 
     data.swarm_size = swarm_size
+    result_cache = get_result_cache(result_cache_dir, result_cache_mb)
+
+    # Store the svn log of the configured range locally, so revision lookups don't need svn
+    prefetch_log(config["branch_path"], config["from_dt"], config["to_dt"])
 
     while True:
         revision = input("Target Revision Id: ")
@@ -68,17 +146,30 @@ def run_optimization(objectives, masked, activity_matrix, demo_config, swarm_siz
             continue
         log_entry = log[0]
 
-        print(f"Running pipeline demo with the following objectives: {objectives}")
+        if output == "text":
+            print(f"Running pipeline demo with the following objectives: {objectives}")
         metrics = [OBJECTIVES_MAP[key] for key in objectives]
         # Reset problem data to original matrices
         data.reset()
 
         # Run pipeline for revision
         revision_results = RevisionResults(
-            log_entry, data.branch, data.ignore_tests, masked
+            log_entry, data.branch, data.ignore_tests, None, masked, data.history
+        )
+        changed_lines = (
+            get_changed_lines(config["branch_path"], log_entry.revision)
+            if line_level
+            else None
+        )
+        run_pipeline(
+            data,
+            metrics,
+            revision_results,
+            config["ignore_changes"],
+            changed_lines,
+            result_cache=result_cache,
         )
-        run_pipeline(data, metrics, revision_results, config["ignore_changes"])
-        revision_results.print_results(data)
+        report_results(revision_results, data, output, with_tests=True)
 
 
 @cli.command("demo")
@@ -90,28 +181,80 @@ def run_optimization(objectives, masked, activity_matrix, demo_config, swarm_siz
     multiple=True,
 )
 @click.option("--masked", is_flag=True)
+@click.option(
+    "--output",
+    default="text",
+    show_default=True,
+    type=click.Choice(OUTPUT_MODES),
+    help="Results of each revision as text, as one compact JSON line, or not at all (quiet)",
+)
+@click.option(
+    "--history",
+    "history_store",
+    type=click.Path(dir_okay=False),
+    help="Use a local SQLite history store instead of the database (created by --refresh-history if missing)",
+)
+@click.option(
+    "--refresh-history",
+    is_flag=True,
+    help="Fetch the days/revisions missing from the history store from the database",
+)
+@click.option(
+    "--line-level",
+    is_flag=True,
+    help="Only map the changed methods of each file, using svn diff and the methods lines",
+)
+@click.option(
+    "--timings",
+    "timings_file",
+    type=click.Path(),
+    help="Measure the latency of each pipeline stage and export its stats to this JSON file",
+)
+@click.option(
+    "--result-cache",
+    "result_cache_dir",
+    type=click.Path(file_okay=False),
+    help="Reuse the solutions found for the same changed methods and objectives, stored in this directory",
+)
+@click.option(
+    "--result-cache-mb",
+    default=DEFAULT_MAX_MB,
+    show_default=True,
+    type=click.FLOAT,
+    help="Maximum size of the result cache in MB (least recently used entries are evicted)",
+)
+@click.option(
+    "--restart",
+    is_flag=True,
+    help="Discard the results log of a previous run instead of resuming it",
+)
 @click.argument("swarm_size", type=click.INT)
 @click.argument("activity_matrix", type=click.Path(exists=True, readable=True))
 @click.argument("demo_config", type=click.Path(exists=True, readable=True))
 @click.argument("output_file", type=click.Path())
 def run_optimization_for_demo(
-    activity_matrix, demo_config, objectives, masked, swarm_size, output_file
+    activity_matrix,
+    demo_config,
+    objectives,
+    masked,
+    output,
+    history_store,
+    refresh_history,
+    line_level,
+    timings_file,
+    result_cache_dir,
+    result_cache_mb,
+    restart,
+    swarm_size,
+    output_file,
 ):
-    def run_tool_for_revision(revision, data, previous_rev, ignore_changes):
-        print(f"Running pipeline demo with the following objectives: {objectives}")
-        metrics = [OBJECTIVES_MAP[key] for key in objectives]
-        # Reset problem data to original matrices
-        data.reset()
-
-        # Run pipeline for revision
-        revision_results = RevisionResults(
-            revision, data.branch, data.ignore_tests, previous_rev, masked
-        )
-        if len(revision_results.real_rev_history) > 0:
-            run_pipeline(data, metrics, revision_results, ignore_changes)
-            revision_results.print_results(data)
+    """
+        Batch execution of the pipeline for each revision in the dates range of the config.
 
-        return revision_results
+        The results of each revision are appended to a log (OUTPUT_FILE.jsonl) as soon as they are ready,
+        so an interrupted run is resumed by running the same command again.
+    """
+    set_output_mode(output)
 
     # Get log based on demo config
     with open(demo_config, mode="r") as demo_file:
@@ -127,30 +270,42 @@ def run_optimization_for_demo(
         config["from_dt"],
         config["to_dt"],
         ignore_tests=config["ignore_tests"],
+        history=get_history_provider(history_store, refresh_history),
     )
+    data.history.get_testfails_for_revisions([log_e.revision for log_e in log])
 
     data.swarm_size = swarm_size
-
-    # Run tool for each revision
-    results = []
-    previous = None
-    # for log_e in log[:100]:
-    for log_e in log:
-        if not is_ignored_project(log_e.changelist, config["ignore_changes"]):
-            res = run_tool_for_revision(log_e, data, previous, config["ignore_changes"])
-            results.append(res)
-            previous = res
-
-    # Build results summary report
-    summary = ResultsSummary(results, data)
+    result_cache = get_result_cache(result_cache_dir, result_cache_mb)
+
+    # Run tool for each revision, resuming from the results log of a previous run (if any)
+    summary = run_demo_batch(
+        data,
+        log,
+        config,
+        objectives,
+        ResultsLog(f"{output_file}.jsonl", restart),
+        masked=masked,
+        output=output,
+        line_level=line_level,
+        timings=timings_file is not None,
+        result_cache=result_cache,
+    )
 
     # - print summary to terminal
-    summary.export_to_text()
+    report_summary(summary, output)
+    if output != "json":
+        print_cache_stats()
+        if result_cache is not None:
+            result_cache.print_stats()
 
     # save data to pickle
     with open(output_file, mode="wb") as output:
         summary.export_to_pickle(output)
 
+    if timings_file is not None:
+        with open(timings_file, mode="w") as output:
+            summary.export_timings_to_json(output)
+
 
 @cli.command("random")
 @click.option("--fixed", is_flag=True, help="Use a fixed test sample for evaluation")
@@ -159,17 +314,309 @@ def run_optimization_for_demo(
     is_flag=True,
     help="Filter matrix using changelist for evaluation fairness with MOTSD",
 )
+@click.option(
+    "--output",
+    default="text",
+    show_default=True,
+    type=click.Choice(OUTPUT_MODES),
+    help="Results of each revision as text, as one compact JSON line, or not at all (quiet)",
+)
+@click.option(
+    "--history",
+    "history_store",
+    type=click.Path(dir_okay=False),
+    help="Use a local SQLite history store instead of the database (created by --refresh-history if missing)",
+)
+@click.option(
+    "--refresh-history",
+    is_flag=True,
+    help="Fetch the days/revisions missing from the history store from the database",
+)
 @click.argument("random_p", type=click.FLOAT)
 @click.argument("all_tests", type=click.Path(exists=True, readable=True))
 @click.argument("activity_matrix", type=click.Path(exists=True, readable=True))
 @click.argument("demo_config", type=click.Path(exists=True, readable=True))
 @click.argument("output_file", type=click.Path())
 def run_random_demo(
-    activity_matrix, demo_config, output_file, random_p, all_tests, fixed, filtered
+    activity_matrix,
+    demo_config,
+    output_file,
+    random_p,
+    all_tests,
+    fixed,
+    filtered,
+    output,
+    history_store,
+    refresh_history,
 ):
+    set_output_mode(output)
+
+    # Get log based on demo config
+    with open(demo_config, mode="r") as demo_file:
+        config = json.load(demo_file)
+
+    log = get_log(config["branch_path"], config["from_dt"], config["to_dt"])
+
+    # Read all tests file
+    with open(all_tests, mode="r") as tests_file:
+        tests = [test.strip() for test in tests_file.readlines()]
+
+    # Build problem data
+    data = ProblemData(
+        activity_matrix,
+        config["branch"],
+        config["fails_start_dt"],
+        config["from_dt"],
+        config["to_dt"],
+        ignore_tests=config["ignore_tests"],
+        history=get_history_provider(history_store, refresh_history),
+    )
+    data.history.get_testfails_for_revisions([log_e.revision for log_e in log])
+
+    # Run tool for each revision
+    summary = run_random_batch(
+        data, log, config, tests, random_p, fixed, filtered, output=output
+    )
+
+    # - print summary to terminal
+    report_summary(summary, output)
+    if output != "json":
+        print_cache_stats()
+
+    # save data to pickle
+    with open(output_file, mode="wb") as output:
+        summary.export_to_pickle(output)
+
+
+@cli.command("serve")
+@click.option("--port", "-p", default=8080, show_default=True, type=click.INT)
+@click.option(
+    "--workers",
+    "-w",
+    default=2,
+    show_default=True,
+    type=click.INT,
+    help="Number of optimizer runs executed in parallel",
+)
+@click.option(
+    "--queue",
+    "queue_size",
+    default=8,
+    show_default=True,
+    type=click.INT,
+    help="Number of requests waiting for a worker before new ones are rejected",
+)
+@click.option(
+    "--reload-interval",
+    default=30,
+    show_default=True,
+    type=click.FLOAT,
+    help="Seconds between checks for changes of the activity matrix, config and history store (0 to disable)",
+)
+@click.option(
+    "--history",
+    "history_store",
+    type=click.Path(dir_okay=False),
+    help="Use a local SQLite history store instead of the database (created by --refresh-history if missing)",
+)
+@click.option(
+    "--refresh-history",
+    is_flag=True,
+    help="Fetch the days/revisions missing from the history store from the database",
+)
+@click.option(
+    "--line-level",
+    is_flag=True,
+    help="Only map the changed methods of each file, using svn diff and the methods lines",
+)
+@click.argument("swarm_size", type=click.INT)
+@click.argument("activity_matrix", type=click.Path(exists=True, readable=True))
+@click.argument("demo_config", type=click.Path(exists=True, readable=True))
+def run_server(
+    port,
+    workers,
+    queue_size,
+    reload_interval,
+    history_store,
+    refresh_history,
+    line_level,
+    swarm_size,
+    activity_matrix,
+    demo_config,
+):
+    """
+        Serve test selection requests over HTTP on localhost, loading the problem data only once
+        (and reloading it in the background when the activity matrix, config or history store change)
+    """
+
+    def load_problem_data():
+        with open(demo_config, mode="r") as config_file:
+            reloaded_config = json.load(config_file)
+        problem_data = ProblemData(
+            activity_matrix,
+            reloaded_config["branch"],
+            reloaded_config["fails_start_dt"],
+            reloaded_config["from_dt"],
+            reloaded_config["to_dt"],
+            ignore_tests=reloaded_config["ignore_tests"],
+            history=get_history_provider(history_store, refresh_history),
+        )
+        problem_data.swarm_size = swarm_size
+        return problem_data
+
+    with open(demo_config, mode="r") as demo_file:
+        config = json.load(demo_file)
+
+    watch_paths = get_activity_data_paths(activity_matrix) + [demo_config]
+    if history_store is not None:
+        watch_paths.append(history_store)
+
+    server = SelectionServer(
+        load_problem_data(),
+        OBJECTIVES_MAP,
+        config["branch_path"],
+        config["ignore_changes"],
+        workers=workers,
+        queue_size=queue_size,
+        line_level=line_level,
+        loader=load_problem_data,
+        watch_paths=watch_paths,
+        reload_interval=reload_interval,
+        seed=SEED,
+    )
+    server.prefetch_log(config["from_dt"], config["to_dt"])
+    server.serve(port)
+
+
+def run_demo_batch(
+    data: ProblemData,
+    log,
+    config,
+    objectives,
+    results_log: ResultsLog,
+    masked=False,
+    output="text",
+    line_level=False,
+    timings=False,
+    result_cache: ResultCache = None,
+) -> ResultsSummary:
+    """
+    Run the pipeline for each revision of a svn log, appending the results of each revision to a log.
+
+    Revisions already in the results log (from an interrupted run) are skipped.
+
+    :param data: problem data
+    :param log: list of svn log entries
+    :param config: demo configuration
+    :param objectives: list of objective names
+    :param results_log: log of the results of each revision
+    :param masked: anonymize the printed results
+    :param output: output mode (text, json or quiet)
+    :param line_level: only map the changed methods of each file, using svn diff
+    :param timings: measure the latency of each pipeline stage
+    :param result_cache: cache of the solutions found for each changeset
+    :return: results summary
+    """
+
+    def run_tool_for_revision(revision, data, previous_rev, ignore_changes):
+        if output == "text":
+            print(f"Running pipeline demo with the following objectives: {objectives}")
+        metrics = [OBJECTIVES_MAP[key] for key in objectives]
+        timer = StageTimer(enabled=timings)
+        # Reset problem data to original matrices
+        data.reset()
+
+        # Run pipeline for revision
+        with timer.span("history"):
+            revision_results = RevisionResults(
+                revision,
+                data.branch,
+                data.ignore_tests,
+                previous_rev,
+                masked,
+                data.history,
+            )
+        if len(revision_results.real_rev_history) > 0:
+            with timer.span("changed_lines"):
+                changed_lines = (
+                    get_changed_lines(config["branch_path"], revision.revision)
+                    if line_level
+                    else None
+                )
+            run_pipeline(
+                data,
+                metrics,
+                revision_results,
+                ignore_changes,
+                changed_lines,
+                timer,
+                result_cache,
+            )
+            with timer.span("print_results"):
+                report_results(revision_results, data, output)
+
+        if timer.enabled:
+            revision_results.timings = timer.export()
+        return revision_results
+
+    # Only the ids of the logged revisions are kept, not their results
+    logged = results_log.get_revisions()
+    if logged:
+        print(f"Resuming run: skipping {len(logged)} revisions in {results_log.path}")
+
+    previous, previous_logged = None, None
+    # for log_e in log[:100]:
+    for log_e in log:
+        if not is_ignored_project(log_e.changelist, config["ignore_changes"]):
+            red = logged.pop(str(log_e.revision), None)
+            if red is not None:
+                # Replay the new files tracking of the skipped revision
+                if red:
+                    data.track_new_files(log_e.changelist, config["ignore_changes"])
+                previous, previous_logged = None, str(log_e.revision)
+            else:
+                if previous_logged is not None:
+                    # The history of the next revision depends on the previous one
+                    previous = results_log.get(previous_logged)
+                    previous_logged = None
+                res = run_tool_for_revision(
+                    log_e, data, previous, config["ignore_changes"]
+                )
+                results_log.append(res)
+                res.solutions_found = []
+                previous = res
+
+    # Build results summary report
+    return ResultsSummary.from_log(results_log, data)
+
+
+def run_random_batch(
+    data: ProblemData,
+    log,
+    config,
+    tests,
+    random_p,
+    fixed=False,
+    filtered=False,
+    output="text",
+) -> ResultsSummary:
+    """
+    Evaluate random test selections for each revision of a svn log.
+
+    :param data: problem data
+    :param log: list of svn log entries
+    :param config: demo configuration
+    :param tests: list of all test names
+    :param random_p: fraction of the tests to be randomly selected
+    :param fixed: use the same test sample for all revisions
+    :param filtered: filter matrix using changelist for evaluation fairness with MOTSD
+    :param output: output mode (text, json or quiet)
+    :return: results summary
+    """
+
     def run_tool_for_revision(revision, data, previous_rev, ignore_changes, t_sample):
         revision_results = RevisionResults(
-            revision, data.branch, data.ignore_tests, previous_rev
+            revision, data.branch, data.ignore_tests, previous_rev, history=data.history
         )
         if filtered:
             # Running in filtered mode for evaluation fairness with MOTSD, i.e. filter matrix with changelist
@@ -189,33 +636,12 @@ def run_random_demo(
 
         if len(revision_results.real_rev_history) > 0:
             revision_results.solutions_found = t_sample
-            revision_results.print_results(data, fixed_demo=True)
+            report_results(revision_results, data, output, fixed_demo=True)
 
         return revision_results
 
-    # Get log based on demo config
-    with open(demo_config, mode="r") as demo_file:
-        config = json.load(demo_file)
-
-    log = get_log(config["branch_path"], config["from_dt"], config["to_dt"])
-
-    # Read all tests file
-    with open(all_tests, mode="r") as tests_file:
-        tests = [test.strip() for test in tests_file.readlines()]
-
     tests_sample = random.sample(tests, int(random_p * (len(tests))))
 
-    # Build problem data
-    data = ProblemData(
-        activity_matrix,
-        config["branch"],
-        config["fails_start_dt"],
-        config["from_dt"],
-        config["to_dt"],
-        ignore_tests=config["ignore_tests"],
-    )
-
-    # Run tool for each revision
     results = []
     previous = None
     # for log_e in log[:100]:
@@ -228,21 +654,26 @@ def run_random_demo(
             previous = res
 
     # Build results summary report
-    summary = ResultsSummary(results, data)
-
-    # - print summary to terminal
-    summary.export_to_text()
+    return ResultsSummary(results, data)
 
-    # save data to pickle
-    with open(output_file, mode="wb") as output:
-        summary.export_to_pickle(output)
 
+def run_pipeline(
+    data,
+    objectives,
+    revision: RevisionResults,
+    ignore_changes,
+    changed_lines=None,
+    timer: StageTimer = None,
+    result_cache: ResultCache = None,
+):
+    if timer is None:
+        timer = StageTimer(enabled=False)
 
-def run_pipeline(data, objectives, revision: RevisionResults, ignore_changes):
     # Get indexes for methods changed by a commit
-    changed_idxs = data.get_changed_indexes_for_changelist(
-        revision.changelist, ignore_changes
-    )
+    with timer.span("changelist"):
+        changed_idxs = data.get_changed_indexes_for_changelist(
+            revision.changelist, ignore_changes, changed_lines
+        )
 
     # Stop pipeline if no changed indexes were extracted
     if type(changed_idxs) == str:
@@ -250,13 +681,35 @@ def run_pipeline(data, objectives, revision: RevisionResults, ignore_changes):
         return
 
     # Filter matrix and indexes based on commit
-    data.filter_data_for_commit(changed_idxs)
+    with timer.span("filter"):
+        data.filter_data_for_commit(changed_idxs)
+
+    key = get_run_key(data, changed_idxs, objectives, SEED)
+
+    # Reuse the solutions found before for the same changed methods, if cached
+    if result_cache is not None:
+        start = time.perf_counter()
+        with timer.span("result_cache"):
+            solution_front = result_cache.get(key, data.tests_index)
+        if solution_front is not None:
+            revision.solutions_found = solution_front
+            # Lookup time, excluded from the computing time stats of the summary
+            revision.computing_time = time.perf_counter() - start
+            revision.cache_hit = True
+            return
 
     # Run optimizer for the reduced matrix
-    problem = TestSelection(data, objectives)
-    solution_front = run_optimizer(my_binary_mopso(problem, data.swarm_size), revision)
+    with timer.span("problem"):
+        problem = TestSelection(data, objectives, timer, seed=get_run_seed(key))
+        algorithm = my_binary_mopso(problem, data.swarm_size)
+    with timer.span("optimizer"):
+        solution_front = run_optimizer(algorithm, revision)
     revision.solutions_found = solution_front
 
+    if result_cache is not None:
+        with timer.span("result_cache"):
+            result_cache.put(key, data.tests_index, solution_front)
+
 
 def run_optimizer(algorithm: Algorithm, revision: RevisionResults):
     # Run optimizer algorithm
@@ -268,6 +721,53 @@ def run_optimizer(algorithm: Algorithm, revision: RevisionResults):
     return sorted(front, key=lambda x: (x.objectives[0], x.objectives[1]))
 
 
+def set_output_mode(output):
+    # Arrays are printed in full only in the text output
+    if output == "text":
+        np.set_printoptions(threshold=np.inf)
+
+
+def report_results(
+    revision: RevisionResults, data, output, fixed_demo=False, with_tests=False
+):
+    if output == "text":
+        revision.print_results(data, fixed_demo=fixed_demo)
+        return
+
+    # Skip the text formatting, but compute the same evaluation values for the summary
+    revision.evaluate(data, fixed_demo=fixed_demo)
+    if output == "json":
+        record = revision.get_record(data, with_tests=with_tests)
+        print(json.dumps(record, default=to_json_value), flush=True)
+
+
+def report_summary(summary: ResultsSummary, output):
+    if output == "json":
+        print(json.dumps(summary.export_to_dict(), default=to_json_value))
+    else:
+        summary.export_to_text()
+
+
+def get_result_cache(result_cache_dir, result_cache_mb):
+    if result_cache_dir is None:
+        return None
+    return ResultCache(result_cache_dir, result_cache_mb)
+
+
+def get_history_provider(history_store, refresh_history):
+    if history_store is not None:
+        if refresh_history:
+            # A missing store is created and filled from the database
+            return IncrementalHistory(DatabaseHistory(), SQLiteHistory(history_store))
+        if not os.path.isfile(history_store):
+            raise click.BadParameter(
+                f"history store {history_store} does not exist (use --refresh-history to create it)",
+                param_hint="--history",
+            )
+        return SQLiteHistory(history_store)
+    return DatabaseHistory()
+
+
 def is_ignored_project(changelist, ignore_changes):
     return all(
         any(